@@ -0,0 +1,238 @@
+"""
+This file is part of nand2tetris, as taught in The Hebrew University, and
+was written by Aviv Yaish. It is an extension to the specifications given
+[here](https://www.nand2tetris.org) (Shimon Schocken and Noam Nisan, 2017),
+as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0
+Unported [License](https://creativecommons.org/licenses/by-nc-sa/3.0/).
+"""
+import argparse
+import io
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+import typing
+from array import array
+from Code import Code
+from Main import assemble, assemble_file, encode_commands, resolve_fixups, \
+    write_binary, write_text
+from Parser import Parser
+from SymbolTable import SymbolTable
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000, 5_000_000]
+ROM_SIZE = 32768
+
+""" C-instructions typical of VM translator output: """
+C_INSTRUCTIONS = ["D=A", "D=M", "M=D", "A=M", "M=M+1", "M=M-1", "AM=M-1",
+                  "AM=M+1", "A=A-1", "D=D+M", "D=M-D", "M=D+M", "M=M-D",
+                  "M=-M", "M=!M", "D=D-A", "A=D+A", "M=0", "M=-1",
+                  "D;JNE", "D;JEQ", "D;JGT", "D;JLT", "0;JMP"]
+PREDEFINED_SYMBOLS = ["SP", "LCL", "ARG", "THIS", "THAT", "R13", "R14",
+                      "R15", "SCREEN", "KBD"]
+
+
+def generate_program(size: int, label_density: float = 0.02,
+                     variables: int = 64, c_ratio: float = 0.6,
+                     seed: int = 0) -> typing.List[str]:
+    """Generates a synthetic assembly program.
+
+    Args:
+        size (int): number of instructions (labels are not counted).
+        label_density (float): labels declared per instruction.
+        variables (int): number of distinct variables the program uses.
+        c_ratio (float): fraction of the instructions that are
+            C-instructions; the rest are A-instructions.
+        seed (int): seed of the random generator, for reproducible programs.
+
+    Returns:
+        typing.List[str]: the program's lines, with some comments and
+        indentation mixed in like in hand-written code. Labels are only
+        declared within the first 32K instructions, since larger addresses
+        do not fit in an A-instruction.
+    """
+    rng = random.Random(seed)
+    label_count = max(1, int(min(size, ROM_SIZE - 1) * label_density))
+    lines = []
+    declared = 0
+    last_label_index = min(size, ROM_SIZE) - 1
+    for index in range(size):
+        if declared < label_count and index <= last_label_index \
+                and rng.random() < label_density:
+            lines.append(f'(L{declared})')
+            declared += 1
+        if index == last_label_index:
+            # every referenced label must be declared somewhere
+            lines.extend(f'(L{label})'
+                         for label in range(declared, label_count))
+            declared = label_count
+        if rng.random() < c_ratio:
+            line = rng.choice(C_INSTRUCTIONS)
+        else:
+            kind = rng.random()
+            if kind < 0.3:
+                line = f'@{rng.randrange(32768)}'
+            elif kind < 0.55 and variables:
+                line = f'@var{rng.randrange(variables)}'
+            elif kind < 0.8:
+                line = f'@L{rng.randrange(label_count)}'
+            else:
+                line = f'@{rng.choice(PREDEFINED_SYMBOLS)}'
+        if index % 16 == 0:
+            line = f'    {line} // comment'
+        lines.append(line)
+    lines.append("0;JMP")
+    return lines
+
+
+def timed(function: typing.Callable, *args) -> typing.Tuple[float,
+                                                            typing.Any]:
+    """
+    Args:
+        function (typing.Callable): the function to time.
+        *args: its arguments.
+
+    Returns:
+        typing.Tuple[float, typing.Any]: the run time in seconds, and the
+        function's result.
+    """
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+def encode(commands: list) -> typing.Tuple[array, SymbolTable, dict]:
+    """Runs the single pass of the assembler, with a cold encoding cache."""
+    Code.c_instructions.clear()
+    return encode_commands(commands)
+
+
+def write_text_file(instructions: array) -> int:
+    """Writes the text .hack format to memory and returns its size."""
+    output_file = io.StringIO()
+    write_text(instructions, output_file)
+    return output_file.tell()
+
+
+def write_packed(instructions: array) -> int:
+    """Writes the packed binary format to memory and returns its size."""
+    output_file = io.BytesIO()
+    write_binary(instructions, output_file)
+    return output_file.tell()
+
+
+def run_assemble_file(source: str, binary: bool) -> None:
+    """Assembles the source with assemble_file, into memory."""
+    Code.c_instructions.clear()
+    output_file = io.BytesIO() if binary else io.StringIO()
+    assemble_file(io.StringIO(source), output_file, binary)
+
+
+def peak_memory(source: str) -> int:
+    """Returns the peak memory allocated while assembling the source."""
+    Code.c_instructions.clear()
+    tracemalloc.start()
+    assemble_file(io.StringIO(source), io.StringIO())
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def benchmark(size: int, label_density: float, variables: int,
+              c_ratio: float, repeat: int, seed: int,
+              measure_memory: bool) -> dict:
+    """Benchmarks every phase of the assembler on one synthetic program:
+    the phases are the functions that assemble itself calls.
+
+    Args:
+        size (int): number of instructions of the program.
+        label_density (float): labels declared per instruction.
+        variables (int): number of distinct variables.
+        c_ratio (float): fraction of C-instructions.
+        repeat (int): runs per phase; the fastest one is kept.
+        seed (int): seed of the program generator.
+        measure_memory (bool): also measure the peak memory of a full run.
+
+    Returns:
+        dict: the timing of every phase, in seconds and in instructions per
+        second, and the peak memory in bytes.
+    """
+    lines = generate_program(size, label_density, variables, c_ratio, seed)
+    source = "\n".join(lines) + "\n"
+    phases = {}
+
+    def record(name: str, function: typing.Callable, *args) -> typing.Any:
+        best = None
+        result = None
+        for _ in range(repeat):
+            seconds, result = timed(function, *args)
+            best = seconds if best is None else min(best, seconds)
+        phases[name] = {"seconds": best,
+                        "instructions_per_second": size / best if best
+                        else None}
+        return result
+
+    parser = record("parse", Parser, lines)
+    commands = parser.commands
+    instructions, symbol_table, fixups = record("single_pass", encode,
+                                                commands)
+    record("fixups", resolve_fixups, instructions, symbol_table, fixups)
+    text_bytes = record("write_text", write_text_file, instructions)
+    binary_bytes = record("write_binary", write_packed, instructions)
+    record("assemble", assemble, lines)
+    record("assemble_file_text", run_assemble_file, source, False)
+    record("assemble_file_binary", run_assemble_file, source, True)
+
+    result = {"size": size, "label_density": label_density,
+              "variables": variables, "c_ratio": c_ratio,
+              "lines": len(lines), "text_output_chars": text_bytes,
+              "binary_output_bytes": binary_bytes, "phases": phases}
+    if measure_memory:
+        result["peak_memory_bytes"] = peak_memory(source)
+    return result
+
+
+def print_result(result: dict) -> None:
+    """Prints one benchmark result as a table."""
+    memory = result.get("peak_memory_bytes")
+    memory = f', peak memory {memory / 2 ** 20:.1f} MiB' \
+        if memory is not None else ""
+    print(f'{result["size"]:,} instructions{memory}')
+    for name, phase in result["phases"].items():
+        print(f'    {name:22} {phase["seconds"]:9.4f} s '
+              f'{phase["instructions_per_second"]:14,.0f} instr/s')
+
+
+if "__main__" == __name__:
+    arg_parser = argparse.ArgumentParser(
+        prog="Benchmark",
+        description="Times every phase of the assembler on synthetic "
+                    "programs and saves the results as JSON.")
+    arg_parser.add_argument("--sizes", type=int, nargs="+",
+                            default=DEFAULT_SIZES,
+                            help="program sizes, in instructions")
+    arg_parser.add_argument("--label-density", type=float, default=0.02)
+    arg_parser.add_argument("--variables", type=int, default=64)
+    arg_parser.add_argument("--c-ratio", type=float, default=0.6)
+    arg_parser.add_argument("--repeat", type=int, default=3,
+                            help="runs per phase; the fastest is reported")
+    arg_parser.add_argument("--seed", type=int, default=0)
+    arg_parser.add_argument("--no-memory", action="store_true",
+                            help="skip the (slow) peak memory measurement")
+    arg_parser.add_argument("--output", default="benchmark_results.json",
+                            help="where to save the results")
+    args = arg_parser.parse_args()
+
+    results = []
+    for size in args.sizes:
+        result = benchmark(size, args.label_density, args.variables,
+                           args.c_ratio, args.repeat, args.seed,
+                           not args.no_memory)
+        print_result(result)
+        results.append(result)
+    with open(args.output, 'w') as output_file:
+        json.dump({"python": sys.version, "platform": platform.platform(),
+                   "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                   "results": results}, output_file, indent=2)
+    print(f'results saved to {args.output}')
@@ -0,0 +1,127 @@
+"""
+This file is part of nand2tetris, as taught in The Hebrew University, and
+was written by Aviv Yaish. It is an extension to the specifications given
+[here](https://www.nand2tetris.org) (Shimon Schocken and Noam Nisan, 2017),
+as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0
+Unported [License](https://creativecommons.org/licenses/by-nc-sa/3.0/).
+"""
+import hashlib
+import json
+import os
+import typing
+
+CACHE_FILE_NAME = ".assembler_cache.json"
+
+
+class BuildCache:
+    """
+    Remembers, for every input file of a directory, a hash of the input that
+    was last built (together with the tool version and options) and a hash of
+    the output it produced. A file whose input and output both still match
+    does not have to be built again.
+    """
+
+    def __init__(self, directory: str, version: str) -> None:
+        """Loads the cache of the given directory. A missing or unreadable
+        cache file is treated as an empty cache.
+
+        Args:
+            directory (str): the directory of the input files.
+            version (str): the version of the tool; changing it invalidates
+                every entry.
+        """
+        self.cache_path = os.path.join(directory, CACHE_FILE_NAME)
+        self.version = version
+        try:
+            with open(self.cache_path, 'r') as cache_file:
+                self.entries = json.load(cache_file)
+        except (OSError, ValueError):
+            self.entries = {}
+        if not isinstance(self.entries, dict):
+            self.entries = {}
+
+    @staticmethod
+    def file_digest(path: str) -> typing.Optional[str]:
+        """
+        Args:
+            path (str): a path to a file.
+
+        Returns:
+            typing.Optional[str]: the SHA-256 of the file's contents, or None
+            if the file cannot be read.
+        """
+        try:
+            with open(path, 'rb') as file:
+                return hashlib.sha256(file.read()).hexdigest()
+        except OSError:
+            return None
+
+    def key(self, input_path: str, options: str = "") -> typing.Optional[str]:
+        """
+        Args:
+            input_path (str): a path to an input file.
+            options (str): the options that affect the output of the file.
+
+        Returns:
+            typing.Optional[str]: a hash of the tool version, the options and
+            the file's contents, or None if the file cannot be read.
+        """
+        digest = BuildCache.file_digest(input_path)
+        if digest is None:
+            return None
+        key = f'{self.version}\n{options}\n{digest}'
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def is_up_to_date(self, input_path: str, output_path: str,
+                      key: typing.Optional[str]) -> bool:
+        """
+        Args:
+            input_path (str): a path to an input file.
+            output_path (str): the path of the file built from it.
+            key (typing.Optional[str]): the current key of the input file.
+
+        Returns:
+            bool: True if the input was built with the same key and its
+            output has not changed since, False otherwise.
+        """
+        entry = self.entries.get(os.path.basename(input_path))
+        if key is None or entry is None or entry.get("key") != key:
+            return False
+        return entry.get("output") == BuildCache.file_digest(output_path)
+
+    def record(self, input_path: str, output_path: str,
+               key: typing.Optional[str]) -> None:
+        """Records that the input was built into output_path with the given
+        key.
+
+        Args:
+            input_path (str): a path to an input file.
+            output_path (str): the path of the file built from it.
+            key (typing.Optional[str]): the key of the input file.
+        """
+        output_digest = BuildCache.file_digest(output_path)
+        if key is None or output_digest is None:
+            self.forget(input_path)
+            return
+        self.entries[os.path.basename(input_path)] = {
+            "key": key, "output": output_digest}
+
+    def forget(self, input_path: str) -> None:
+        """Removes the entry of the given input file, if there is one.
+
+        Args:
+            input_path (str): a path to an input file.
+        """
+        self.entries.pop(os.path.basename(input_path), None)
+
+    def save(self) -> None:
+        """Writes the cache back to its directory. The file is replaced
+        atomically, so an interrupted build never leaves a corrupt cache.
+        """
+        temp_path = self.cache_path + ".tmp"
+        try:
+            with open(temp_path, 'w') as cache_file:
+                json.dump(self.entries, cache_file, indent=1, sort_keys=True)
+            os.replace(temp_path, self.cache_path)
+        except OSError:
+            pass
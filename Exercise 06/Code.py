@@ -6,85 +6,139 @@ as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0
 Unported [License](https://creativecommons.org/licenses/by-nc-sa/3.0/).
 """
 
+""" encodings of the C-instruction fields: """
+DEST_CODES = {"": 0b000, "null": 0b000, "M": 0b001,
+              "D": 0b010, "MD": 0b011, "A": 0b100,
+              "AM": 0b101, "AD": 0b110, "AMD": 0b111}
+
+COMP_CODES = {"null": 0b0101010,
+              "0": 0b0101010,
+              "1": 0b0111111,
+              "-1": 0b0111010,
+              "D": 0b0001100,
+              "A": 0b0110000,
+              "!D": 0b0001101,
+              "!A": 0b0110001,
+              "-D": 0b0001111,
+              "-A": 0b0110011,
+              "D+1": 0b0011111,
+              "A+1": 0b0110111,
+              "D-1": 0b0001110,
+              "A-1": 0b0110010,
+              "D+A": 0b0000010,
+              "D-A": 0b0010011,
+              "A-D": 0b0000111,
+              "D&A": 0b0000000,
+              "D|A": 0b0010101,
+
+              "M": 0b1110000,
+              "!M": 0b1110001,
+              "-M": 0b1110011,
+              "M+1": 0b1110111,
+              "M-1": 0b1110010,
+              "D+M": 0b1000010,
+              "D-M": 0b1010011,
+              "M-D": 0b1000111,
+              "D&M": 0b1000000,
+              "D|M": 0b1010101,
+
+              # the commuted forms, as emitted by the VM translator
+              "A+D": 0b0000010,
+              "A&D": 0b0000000,
+              "A|D": 0b0010101,
+              "M+D": 0b1000010,
+              "M&D": 0b1000000,
+              "M|D": 0b1010101,
+
+              "A<<": 0b0100000,
+              "D<<": 0b0110000,
+              "M<<": 0b1100000,
+              "A>>": 0b0000000,
+              "D>>": 0b0010000,
+              "M>>": 0b1000000
+              }
+
+JUMP_CODES = {"": 0b000, "null": 0b000, "JGT": 0b001,
+              "JEQ": 0b010, "JGE": 0b011, "JLT": 0b100,
+              "JNE": 0b101, "JLE": 0b110, "JMP": 0b111}
+
+C_PREFIX = 0b111 << 13
+SHIFT_PREFIX = 0b101 << 13
+
 
 class Code:
     """Translates Hack assembly language mnemonics into binary codes."""
 
+    """static cache of encoded C-instructions, keyed by the instruction"""
+    c_instructions = {}
+
     @staticmethod
-    def dest(mnemonic: str) -> str:
+    def dest(mnemonic: str) -> int:
         """
         Args:
             mnemonic (str): a dest mnemonic string.
 
         Returns:
-            str: 3-bit long binary code of the given mnemonic.
+            int: 3-bit long binary code of the given mnemonic.
         """
-        dictDest = {"": "000", "null": "000", "M": "001",
-                    "D": "010", "MD": "011", "A": "100",
-                    "AM": "101", "AD": "110", "AMD": "111"}
-
-        return dictDest[mnemonic]
+        return DEST_CODES[mnemonic]
 
     @staticmethod
-    def comp(mnemonic: str) -> str:
+    def comp(mnemonic: str) -> int:
         """
         Args:
             mnemonic (str): a comp mnemonic string.
 
         Returns:
-            str: the binary code of the given mnemonic.
+            int: 7-bit long binary code of the given mnemonic.
         """
-        dictComp = {"null": "0101010",
-                    "0": "0101010",
-                    "1": "0111111",
-                    "-1": "0111010",
-                    "D": "0001100",
-                    "A": "0110000",
-                    "!D": "0001101",
-                    "!A": "0110001",
-                    "-D": "0001111",
-                    "-A": "0110011",
-                    "D+1": "0011111",
-                    "A+1": "0110111",
-                    "D-1": "0001110",
-                    "A-1": "0110010",
-                    "D+A": "0000010",
-                    "D-A": "0010011",
-                    "A-D": "0000111",
-                    "D&A": "0000000",
-                    "D|A": "0010101",
-
-                    "M": "1110000",
-                    "!M": "1110001",
-                    "-M": "1110011",
-                    "M+1": "1110111",
-                    "M-1": "1110010",
-                    "D+M": "1000010",
-                    "D-M": "1010011",
-                    "M-D": "1000111",
-                    "D&M": "1000000",
-                    "D|M": "1010101",
-
-                    "A<<": "0100000",
-                    "D<<": "0110000",
-                    "M<<": "1100000",
-                    "A>>": "0000000",
-                    "D>>": "0010000",
-                    "M>>": "1000000"
-                    }
-        return dictComp[mnemonic]
+        return COMP_CODES[mnemonic]
 
     @staticmethod
-    def jump(mnemonic: str) -> str:
+    def jump(mnemonic: str) -> int:
         """
         Args:
             mnemonic (str): a jump mnemonic string.
 
         Returns:
-            str: 3-bit long binary code of the given mnemonic.
+            int: 3-bit long binary code of the given mnemonic.
         """
-        dictJump = {"": "000", "null": "000", "JGT": "001",
-                    "JEQ": "010", "JGE": "011", "JLT": "100",
-                    "JNE": "101", "JLE": "110", "JMP": "111"}
+        return JUMP_CODES[mnemonic]
+
+    @staticmethod
+    def c_instruction(command: str) -> int:
+        """Encodes a whole C-instruction of the form dest=comp;jump.
+        Programs repeat the same few C-instructions over and over, so every
+        instruction is split and encoded only once, and later lookups are
+        served from the cache.
+
+        Args:
+            command (str): a C-instruction without white space and comments.
+
+        Returns:
+            int: the 16-bit binary code of the given instruction.
+        """
+        word = Code.c_instructions.get(command)
+        if word is not None:
+            return word
+
+        dest_mnemonic = ""
+        comp_mnemonic = command
+        jump_mnemonic = ""
+        if '=' in comp_mnemonic:
+            equalInd = comp_mnemonic.find('=')
+            dest_mnemonic = comp_mnemonic[:equalInd]
+            comp_mnemonic = comp_mnemonic[equalInd + 1:]
+        if ';' in comp_mnemonic:
+            semicolonInd = comp_mnemonic.find(';')
+            jump_mnemonic = comp_mnemonic[semicolonInd + 1:]
+            comp_mnemonic = comp_mnemonic[:semicolonInd]
 
-        return dictJump[mnemonic]
+        if '<' in comp_mnemonic or '>' in comp_mnemonic:
+            prefix = SHIFT_PREFIX
+        else:
+            prefix = C_PREFIX
+        word = prefix | Code.comp(comp_mnemonic) << 6 \
+            | Code.dest(dest_mnemonic) << 3 | Code.jump(jump_mnemonic)
+        Code.c_instructions[command] = word
+        return word
@@ -5,117 +5,427 @@ was written by Aviv Yaish. It is an extension to the specifications given
 as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0
 Unported [License](https://creativecommons.org/licenses/by-nc-sa/3.0/).
 """
+import argparse
+import concurrent.futures
 import os
 import sys
+import tempfile
 import typing
+from array import array
 from SymbolTable import SymbolTable
-from Parser import Parser
+from Parser import Parser, read_commands, A_COMMAND, C_COMMAND, \
+    L_COMMAND
 from Code import Code
+from BuildCache import BuildCache
+from Optimizer import Optimizer
 
+""" bump when a change to the assembler changes its output: """
+ASSEMBLER_VERSION = "2"
+""" number of instructions assemble_stream buffers at a time: """
+STREAM_CHUNK_SIZE = 1 << 16
 
-def assemble_file(input_file: typing.TextIO,
-                  output_file: typing.TextIO) -> None:
-    """Assembles a single file.
+
+def assemble(program: typing.Union[str, typing.Iterable[str]],
+             optimizer: typing.Optional[Optimizer] = None) -> array:
+    """Assembles a program in memory, in a single pass.
+
+    References to labels that are declared further down the program are
+    recorded as fixups and patched once the whole input has been read, so
+    the input is read only once and does not have to be seekable (pipes and
+    stdin work as well as regular files).
 
     Args:
-        input_file (typing.TextIO): the file to assemble.
-        output_file (typing.TextIO): writes all output to this file.
-    """
-    parser = Parser(input_file)
-    symbolTable = SymbolTable()
+        program (typing.Union[str, typing.Iterable[str]]): the assembly
+            program, either as a single string or as an iterable of lines
+            (such as an open file).
+        optimizer (typing.Optional[Optimizer]): if given, the parsed program
+            goes through this peephole optimizer before it is encoded.
 
-    """" First-pass:
-     For each label declaration of the form
-     Add the pair <symbol, address to the symbol table,
-     where address is the number of the instruction
-     following the (symbol) label declaration
+    Returns:
+        array: the machine code, one unsigned 16-bit word ('H') per
+        instruction.
     """
-    labels_count = 0
-    while parser.has_more_commands():
-        if parser.command_type() == "L_COMMAND":
-            symbolTable.add_entry(parser.symbol(),
-                                  parser.get_cur_line_number() - labels_count)
-            labels_count += 1
-
-        parser.advance()
-
-    """ Second-pass:
-    Set countSymbols to 16;
-    Scan the entire program (again):
-    For each instruction:
-    If the instruction is @symbol,look up symbol in the symbol table;
-    If <symbol, value> is found, use value to complete the
-    instruction's translation; 
-    Else:
-    Add <symbol, n> to the symbol table.
-    Use countSymbols to complete the instruction's translation.
-    countSymbols++
-    If the instruction is a C-instruction, translate each field
-    Assemble the translated fields into a 16-bit instruction,
-    and write it to the output file.
+    if isinstance(program, str):
+        program = program.splitlines()
+    parser = Parser(program)
+    commands = parser.commands
+    if optimizer is not None:
+        commands = optimizer.optimize(commands)
+    instructions, symbolTable, fixups = encode_commands(commands)
+    resolve_fixups(instructions, symbolTable, fixups)
+    return instructions
+
+
+def encode_commands(commands: list) -> typing.Tuple[
+        array, SymbolTable, typing.Dict[str, typing.List[int]]]:
+    """The single pass of assemble.
+    For each label declaration (symbol), add the pair <symbol, address> to
+    the symbol table, where address is the number of the instruction
+    following the declaration.
+    For each instruction @symbol, use the symbol's value if it is already
+    known. Otherwise remember the position of the instruction: the symbol is
+    either a label that is declared later on, or a variable.
+    C-instructions are encoded as they are read.
+
+    Args:
+        commands (list): the parsed commands of the program.
+
+    Returns:
+        typing.Tuple[array, SymbolTable, typing.Dict[str, typing.List[int]]]:
+        the machine code, with 0 in place of the unresolved symbols, the
+        symbol table of the labels, and the fixups: the positions of the
+        @symbol instructions of every unresolved symbol, in the order in
+        which the symbols first appear.
     """
-    input_file.seek(0)
-    secParser = Parser(input_file)
-    countSymbols = 16  # n
-    while secParser.has_more_commands():
-        if secParser.command_type() == "A_COMMAND":
-            cur_symbol = secParser.symbol()
+    symbolTable = SymbolTable()
+    instructions = array('H')
+    fixups = {}  # symbol -> positions of the @symbol instructions using it
+    for command in commands:
+        command_type = command.command_type
+        if command_type == A_COMMAND:
+            cur_symbol = command.symbol
             if cur_symbol.isnumeric():
-                cur_value = int(cur_symbol)
+                instructions.append(int(cur_symbol))
             elif symbolTable.contains(cur_symbol):
-                cur_value = symbolTable.get_address(cur_symbol)
+                instructions.append(symbolTable.get_address(cur_symbol))
+            else:
+                fixups.setdefault(cur_symbol, []).append(len(instructions))
+                instructions.append(0)
+
+        elif command_type == C_COMMAND:
+            instructions.append(Code.c_instruction(command.command))
 
+        elif command_type == L_COMMAND:
+            symbolTable.add_entry(command.symbol, len(instructions))
+    return instructions, symbolTable, fixups
+
+
+def resolve_fixups(instructions: array, symbolTable: SymbolTable,
+                   fixups: typing.Dict[str, typing.List[int]]) -> None:
+    """The backpatching of assemble.
+    Every symbol that is still unresolved after the whole program was read
+    is a variable. Variables get the addresses 16, 17, ... in the order in
+    which they first appear in the program, exactly like the second pass of
+    the two-pass scheme would assign them.
+
+    Args:
+        instructions (array): the machine code, patched in place.
+        symbolTable (SymbolTable): the labels of the program. It is not
+            changed, so the same pass can run on it again.
+        fixups (typing.Dict[str, typing.List[int]]): the fixups, as
+            returned by encode_commands.
+    """
+    countSymbols = 16  # n
+    for cur_symbol, positions in fixups.items():
+        if symbolTable.contains(cur_symbol):
+            cur_value = symbolTable.get_address(cur_symbol)
+        else:
+            cur_value = countSymbols
+            countSymbols += 1
+        for position in positions:
+            instructions[position] = cur_value
+
+
+def write_binary(instructions: array, output_file: typing.BinaryIO) -> None:
+    """Writes machine code as packed little-endian unsigned 16-bit words, so
+    loaders can read a program back with array('H').frombytes (or mmap it)
+    instead of parsing text.
+
+    Args:
+        instructions (array): the machine code, as returned by assemble.
+        output_file (typing.BinaryIO): a file opened in binary mode.
+    """
+    if sys.byteorder == "big":
+        instructions = array('H', instructions)
+        instructions.byteswap()
+    output_file.write(instructions.tobytes())
+
+
+def write_text(instructions: array, output_file: typing.TextIO) -> None:
+    """Writes machine code in the text .hack format: one line of 16 '0'/'1'
+    characters per instruction.
+
+    Args:
+        instructions (array): the machine code, as returned by assemble.
+        output_file (typing.TextIO): a file opened in text mode.
+    """
+    for instruction in instructions:
+        output_file.write(f'{instruction:016b}\n')
+
+
+def assemble_file(input_file: typing.TextIO, output_file: typing.IO,
+                  binary: bool = False,
+                  optimizer: typing.Optional[Optimizer] = None) -> None:
+    """Assembles a single file.
+
+    Args:
+        input_file (typing.TextIO): the file to assemble.
+        output_file (typing.IO): writes all output to this file.
+        binary (bool): if this is True, the output is written as packed
+            16-bit words (see write_binary) and output_file must be opened
+            in binary mode. Otherwise one line of 16 '0'/'1' characters is
+            written per instruction.
+        optimizer (typing.Optional[Optimizer]): the peephole optimizer to
+            run before encoding, if any.
+    """
+    instructions = assemble(input_file, optimizer)
+    if binary:
+        write_binary(instructions, output_file)
+        return
+    write_text(instructions, output_file)
+
+
+def assemble_stream(input_file: typing.Iterable[str], output_file: typing.IO,
+                    binary: bool = False) -> None:
+    """Assembles a program of any size in constant memory.
+
+    The input is read lazily, one line at a time, and the machine code is
+    spooled to a temporary file in fixed-size chunks. Only the symbol table
+    and the fixups (the positions of @symbol instructions whose symbol was
+    not known yet when they were read) are kept in memory. Once the input is
+    exhausted, the spool is copied to output_file chunk by chunk, and the
+    fixups are patched on the way. The output is the same as assemble_file's.
+
+    Args:
+        input_file (typing.Iterable[str]): the program, as an iterable of
+            lines (such as an open file, a pipe or stdin).
+        output_file (typing.IO): writes all output to this file. It does not
+            have to be seekable.
+        binary (bool): write packed 16-bit words (see write_binary) instead
+            of text.
+    """
+    symbolTable = SymbolTable()
+    unresolved = {}  # symbol -> its index, in order of first appearance
+    fixup_positions = array('I')  # ascending, since the input is read once
+    fixup_symbols = array('I')  # index of the symbol of each fixup
+    with tempfile.TemporaryFile() as spool:
+        chunk = array('H')
+        address = 0
+        for command in read_commands(input_file):
+            first = command[0]
+            if first == "(":
+                symbolTable.add_entry(command[1:len(command) - 1], address)
+                continue
+            if first == "@":
+                cur_symbol = command[1:]
+                if cur_symbol.isnumeric():
+                    chunk.append(int(cur_symbol))
+                elif symbolTable.contains(cur_symbol):
+                    chunk.append(symbolTable.get_address(cur_symbol))
+                else:
+                    fixup_positions.append(address)
+                    fixup_symbols.append(
+                        unresolved.setdefault(cur_symbol, len(unresolved)))
+                    chunk.append(0)
             else:
-                symbolTable.add_entry(secParser.symbol(), countSymbols)
+                chunk.append(Code.c_instruction(command))
+            address += 1
+            if len(chunk) == STREAM_CHUNK_SIZE:
+                chunk.tofile(spool)
+                chunk = array('H')
+        chunk.tofile(spool)
+
+        # Unresolved symbols that were never declared as labels are
+        # variables, allocated in the order of their first appearance.
+        values = []
+        countSymbols = 16  # n
+        for cur_symbol in unresolved:
+            if not symbolTable.contains(cur_symbol):
+                symbolTable.add_entry(cur_symbol, countSymbols)
                 countSymbols += 1
-                cur_value = symbolTable.get_address(cur_symbol)
-
-            final_val = '0' + f'{cur_value:015b}'
-            output_file.write(final_val + "\n")
-            secParser.advance()
-            continue
-
-        elif secParser.command_type() == "C_COMMAND":
-            dest_field = secParser.dest()
-            comp_field = secParser.comp()
-            jump_field = secParser.jump()
-
-            code_dest = Code.dest(dest_field)
-            code_comp = Code.comp(comp_field)
-            code_jump = Code.jump(jump_field)
-            if '<' in comp_field or '>' in comp_field:
-                final_val = "101" + code_comp + code_dest + code_jump
+            values.append(symbolTable.get_address(cur_symbol))
+
+        spool.seek(0)
+        start = 0
+        fixup = 0
+        while start < address:
+            chunk = array('H')
+            chunk.fromfile(spool, min(STREAM_CHUNK_SIZE, address - start))
+            end = start + len(chunk)
+            while fixup < len(fixup_positions) \
+                    and fixup_positions[fixup] < end:
+                chunk[fixup_positions[fixup] - start] = \
+                    values[fixup_symbols[fixup]]
+                fixup += 1
+            if binary:
+                write_binary(chunk, output_file)
+            else:
+                output_file.write("".join(
+                    f'{instruction:016b}\n' for instruction in chunk))
+            start = end
+
+
+def hack_path(input_path: str) -> str:
+    """
+    Args:
+        input_path (str): path of an .asm file.
+
+    Returns:
+        str: the path of the .hack file it is assembled into.
+    """
+    filename, extension = os.path.splitext(input_path)
+    return filename + ".hack"
+
+
+def assemble_path(input_path: str, binary: bool = False,
+                  optimize: bool = False,
+                  stream: bool = False) -> typing.Tuple[
+        typing.Optional[str], typing.Optional[str]]:
+    """Assembles the .asm file at the given path into a .hack file next to it.
+    Errors are returned instead of raised, so that a batch of files can be
+    assembled (possibly in worker processes) and all failures reported at
+    the end.
+
+    Args:
+        input_path (str): path of the .asm file to assemble.
+        binary (bool): write the packed binary format (see assemble_file).
+        optimize (bool): run the peephole optimizer before encoding.
+        stream (bool): assemble in constant memory (see assemble_stream).
+            Cannot be combined with optimize.
+
+    Returns:
+        typing.Tuple[typing.Optional[str], typing.Optional[str]]: a
+        description of the error (None on success), and the optimizer's
+        report (None if the optimizer did not run).
+    """
+    output_path = hack_path(input_path)
+    optimizer = Optimizer() if optimize else None
+    try:
+        with open(input_path, 'r') as input_file, \
+                open(output_path, 'wb' if binary else 'w') as output_file:
+            if stream:
+                assemble_stream(input_file, output_file, binary)
             else:
-                final_val = "111" + code_comp + code_dest + code_jump
-            output_file.write(final_val + '\n')
-            secParser.advance()
-            continue
+                assemble_file(input_file, output_file, binary, optimizer)
+    except Exception as error:
+        return f'{input_path}: {type(error).__name__}: {error}', None
+    if optimizer is None:
+        return None, None
+    return None, optimizer.report(os.path.basename(input_path))
+
+
+def assemble_paths(input_paths: typing.List[str], binary: bool = False,
+                   jobs: int = 1, optimize: bool = False,
+                   stream: bool = False) -> typing.Tuple[
+        typing.Dict[str, str], typing.List[str]]:
+    """Assembles every given .asm file. The files are independent, so with
+    more than one job they are spread over a pool of worker processes.
+    The output of every file is the same whatever the number of jobs.
+
+    Args:
+        input_paths (typing.List[str]): paths of the .asm files to assemble.
+        binary (bool): write the packed binary format (see assemble_file).
+        jobs (int): number of worker processes to use.
+        optimize (bool): run the peephole optimizer before encoding.
+        stream (bool): assemble in constant memory (see assemble_stream).
 
-        elif secParser.command_type() == "L_COMMAND":
-            secParser.advance()
-            continue
+    Returns:
+        typing.Tuple[typing.Dict[str, str], typing.List[str]]: the error of
+        every file that failed, keyed by its path, and the optimizer's
+        reports, both in the order of input_paths.
+    """
+    count = len(input_paths)
+    if jobs <= 1 or count <= 1:
+        results = [assemble_path(input_path, binary, optimize, stream)
+                   for input_path in input_paths]
+    else:
+        chunk_size = max(1, count // (jobs * 4))
+        with concurrent.futures.ProcessPoolExecutor(jobs) as executor:
+            results = list(executor.map(
+                assemble_path, input_paths, [binary] * count,
+                [optimize] * count, [stream] * count,
+                chunksize=chunk_size))
+    errors = {input_path: error
+              for input_path, (error, report) in zip(input_paths, results)
+              if error is not None}
+    reports = [report for error, report in results if report is not None]
+    return errors, reports
 
 
 if "__main__" == __name__:
-    # Parses the input path and calls assemble_file on each input file.
-    # This opens both the input and the output files!
-    # Both are closed automatically when the code finishes running.
-    # If the output file does not exist, it is created automatically in the
+    # Parses the input path and assembles each input file.
+    # If an output file does not exist, it is created automatically in the
     # correct path, using the correct filename.
-    if not len(sys.argv) == 2:
-        sys.exit("Invalid usage, please use: Assembler <input path>")
-    argument_path = os.path.abspath(sys.argv[1])
+    # The path "-" reads the program from stdin and writes the machine code
+    # to stdout, so the assembler can also be used at the end of a pipe.
+    arg_parser = argparse.ArgumentParser(prog="Assembler")
+    arg_parser.add_argument(
+        "input_path",
+        help='an .asm file, a directory of .asm files, or "-" for stdin')
+    arg_parser.add_argument(
+        "--binary", action="store_true",
+        help="write packed little-endian 16-bit words instead of text")
+    arg_parser.add_argument(
+        "--jobs", type=int, default=1, metavar="N",
+        help="assemble the files of a directory on N processes "
+             "(0 uses every CPU)")
+    arg_parser.add_argument(
+        "--optimize", action="store_true",
+        help="run the peephole optimizer before encoding, and report the "
+             "instructions it saved")
+    arg_parser.add_argument(
+        "--stream", action="store_true",
+        help="assemble in constant memory, for programs too large to hold "
+             "in memory (cannot be combined with --optimize)")
+    arg_parser.add_argument(
+        "--no-cache", action="store_true",
+        help="assemble every file, even if it did not change since the "
+             "last build")
+    args = arg_parser.parse_args()
+    if args.stream and args.optimize:
+        arg_parser.error("--stream cannot be combined with --optimize")
+
+    if args.input_path == "-":
+        optimizer = Optimizer() if args.optimize else None
+        output_file = sys.stdout.buffer if args.binary else sys.stdout
+        if args.stream:
+            assemble_stream(sys.stdin, output_file, args.binary)
+        else:
+            assemble_file(sys.stdin, output_file, args.binary, optimizer)
+        if optimizer is not None:
+            print(optimizer.report("<stdin>"), file=sys.stderr)
+        sys.exit(0)
+    argument_path = os.path.abspath(args.input_path)
     if os.path.isdir(argument_path):
+        directory = argument_path
         files_to_assemble = [
             os.path.join(argument_path, filename)
-            for filename in os.listdir(argument_path)]
+            for filename in sorted(os.listdir(argument_path))]
     else:
+        directory = os.path.dirname(argument_path)
         files_to_assemble = [argument_path]
-    for input_path in files_to_assemble:
-        filename, extension = os.path.splitext(input_path)
-        if extension.lower() != ".asm":
-            continue
-        output_path = filename + ".hack"
-        with open(input_path, 'r') as input_file, \
-                open(output_path, 'w') as output_file:
-            assemble_file(input_file, output_file)
+    files_to_assemble = [
+        input_path for input_path in files_to_assemble
+        if os.path.splitext(input_path)[1].lower() == ".asm"]
+
+    # Files whose contents (and the assembler version and options) did not
+    # change since the last build, and whose .hack is still the one that
+    # build wrote, are skipped.
+    cache = None
+    keys = {}
+    if not args.no_cache:
+        cache = BuildCache(directory, ASSEMBLER_VERSION)
+        options = ("binary" if args.binary else "text") \
+            + (" optimize" if args.optimize else "")
+        for input_path in files_to_assemble:
+            keys[input_path] = cache.key(input_path, options)
+        files_to_assemble = [
+            input_path for input_path in files_to_assemble
+            if not cache.is_up_to_date(input_path, hack_path(input_path),
+                                       keys[input_path])]
+
+    jobs = args.jobs if args.jobs > 0 else os.cpu_count()
+    errors, reports = assemble_paths(files_to_assemble, args.binary, jobs,
+                                     args.optimize, args.stream)
+    for report in reports:
+        print(report, file=sys.stderr)
+    if cache is not None:
+        for input_path in files_to_assemble:
+            if input_path in errors:
+                cache.forget(input_path)
+            else:
+                cache.record(input_path, hack_path(input_path),
+                             keys[input_path])
+        cache.save()
+    if errors:
+        sys.exit("\n".join(errors.values()))
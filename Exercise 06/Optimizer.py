@@ -0,0 +1,168 @@
+"""
+This file is part of nand2tetris, as taught in The Hebrew University, and
+was written by Aviv Yaish. It is an extension to the specifications given
+[here](https://www.nand2tetris.org) (Shimon Schocken and Noam Nisan, 2017),
+as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0
+Unported [License](https://creativecommons.org/licenses/by-nc-sa/3.0/).
+"""
+import typing
+from Parser import Command, A_COMMAND, C_COMMAND, L_COMMAND
+
+REDUNDANT_LOAD = "redundant @ (A already holds the value)"
+DEAD_LOAD = "dead @ (overwritten by the next @)"
+INC_DEC_PAIR = "M=M+1 / M=M-1 pair"
+INC_DEC_FUSION = "M=M+1 / AM=M-1 fused into A=M"
+RELOAD_AFTER_STORE = "D=M after M=D"
+STORE_AFTER_LOAD = "M=D after D=M"
+
+""" C-instructions that leave D equal to M (and do not change A): """
+D_EQUALS_M = {"D=M", "M=D", "MD=D", "MD=M"}
+INVERSE_UPDATES = {"M=M+1": "M=M-1", "M=M-1": "M=M+1"}
+FUSED_UPDATES = {("M=M+1", "AM=M-1"), ("M=M-1", "AM=M+1")}
+JUMP_COMMANDS = ("JGT", "JEQ", "JGE", "JLT", "JNE", "JLE", "JMP")
+
+
+class Optimizer:
+    """
+    A peephole optimizer for parsed Hack programs. It removes or fuses
+    redundant instruction sequences, such as the ones the VM translator
+    emits between consecutive stack operations:
+    - @X when A already holds X (no label and no write to A in between).
+    - @X immediately followed by another @ instruction.
+    - M=M+1 immediately followed by M=M-1 (and the other way around).
+    - M=M+1 followed by AM=M-1, which is the same as A=M.
+    - D=M right after M=D (or M=D right after D=M).
+    Labels are barriers: instructions are only merged when no label lies
+    between them, since a label can be reached from anywhere.
+    Removing instructions moves code in ROM, so jump targets must be labels.
+    Programs that jump to numeric ROM addresses are left unchanged.
+    """
+
+    def __init__(self) -> None:
+        """Creates an optimizer with zeroed statistics."""
+        self.hits = {REDUNDANT_LOAD: 0, DEAD_LOAD: 0, INC_DEC_PAIR: 0,
+                     INC_DEC_FUSION: 0, RELOAD_AFTER_STORE: 0,
+                     STORE_AFTER_LOAD: 0}
+        self.instructions_before = 0
+        self.instructions_after = 0
+
+    @staticmethod
+    def count_instructions(commands: typing.List[Command]) -> int:
+        """
+        Args:
+            commands (typing.List[Command]): a parsed program.
+
+        Returns:
+            int: the number of ROM words the program takes.
+        """
+        return sum(1 for command in commands
+                   if command.command_type != L_COMMAND)
+
+    @staticmethod
+    def uses_numeric_jumps(commands: typing.List[Command]) -> bool:
+        """
+        Args:
+            commands (typing.List[Command]): a parsed program.
+
+        Returns:
+            bool: True if the program jumps to a numeric ROM address.
+        """
+        for previous, command in zip(commands, commands[1:]):
+            if previous.command_type == A_COMMAND \
+                    and previous.symbol.isnumeric() \
+                    and command.command_type == C_COMMAND \
+                    and command.jump in JUMP_COMMANDS:
+                return True
+        return False
+
+    def optimize(self, commands: typing.List[Command]) -> typing.List[
+            Command]:
+        """Optimizes a parsed program, until no pattern applies anymore.
+
+        Args:
+            commands (typing.List[Command]): the program's commands, as
+                parsed by Parser.
+
+        Returns:
+            typing.List[Command]: the optimized program.
+        """
+        before = Optimizer.count_instructions(commands)
+        self.instructions_before += before
+        if not Optimizer.uses_numeric_jumps(commands):
+            length = None
+            while length != len(commands):
+                length = len(commands)
+                commands = self.optimize_once(commands)
+        self.instructions_after += Optimizer.count_instructions(commands)
+        return commands
+
+    def optimize_once(self, commands: typing.List[Command]) -> typing.List[
+            Command]:
+        """Runs a single pass of the optimizer over the program.
+
+        Args:
+            commands (typing.List[Command]): the program's commands.
+
+        Returns:
+            typing.List[Command]: the optimized program.
+        """
+        output = []
+        known_a = None  # the symbol A is known to hold, if any
+        for command in commands:
+            command_type = command.command_type
+            previous = output[-1] if output else None
+            if command_type == L_COMMAND:
+                known_a = None
+
+            elif command_type == A_COMMAND:
+                if command.symbol == known_a:
+                    self.hits[REDUNDANT_LOAD] += 1
+                    continue
+                if previous is not None \
+                        and previous.command_type == A_COMMAND:
+                    self.hits[DEAD_LOAD] += 1
+                    output.pop()
+                known_a = command.symbol
+
+            elif command_type == C_COMMAND and previous is not None \
+                    and previous.command_type == C_COMMAND:
+                text = command.command
+                if INVERSE_UPDATES.get(previous.command) == text:
+                    self.hits[INC_DEC_PAIR] += 1
+                    output.pop()
+                    continue
+                if (previous.command, text) in FUSED_UPDATES:
+                    self.hits[INC_DEC_FUSION] += 1
+                    output[-1] = Command("A=M")
+                    known_a = None
+                    continue
+                if text == "D=M" and previous.command in D_EQUALS_M:
+                    self.hits[RELOAD_AFTER_STORE] += 1
+                    continue
+                if text == "M=D" and previous.command in D_EQUALS_M:
+                    self.hits[STORE_AFTER_LOAD] += 1
+                    continue
+
+            if command_type == C_COMMAND and 'A' in command.dest:
+                known_a = None
+            output.append(command)
+        return output
+
+    def report(self, name: str) -> str:
+        """
+        Args:
+            name (str): the name of the optimized program.
+
+        Returns:
+            str: a summary of the instructions saved by each pattern.
+        """
+        saved = self.instructions_before - self.instructions_after
+        percent = 100 * saved / self.instructions_before \
+            if self.instructions_before else 0
+        lines = [f'{name}: {self.instructions_before} -> '
+                 f'{self.instructions_after} instructions '
+                 f'({saved} saved, {percent:.1f}%)']
+        for pattern, hits in self.hits.items():
+            if hits:
+                lines.append(f'    {hits:7} x {pattern}')
+        return "\n".join(lines)
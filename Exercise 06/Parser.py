@@ -7,6 +7,71 @@ Unported [License](https://creativecommons.org/licenses/by-nc-sa/3.0/).
 """
 import typing
 
+A_COMMAND = "A_COMMAND"
+C_COMMAND = "C_COMMAND"
+L_COMMAND = "L_COMMAND"
+
+
+def read_commands(input_file: typing.Iterable[str]) -> typing.Iterator[str]:
+    """Reads the input lazily, one line at a time, and removes all white
+    space and comments.
+
+    Args:
+        input_file (typing.Iterable[str]): input file, or any iterable of
+            lines.
+
+    Yields:
+        str: the next command of the input.
+    """
+    for line in input_file:
+        line = "".join(line.split())
+        if not line or line.startswith("/"):
+            continue
+        if '/' in line:
+            slashInd = line.find('/')
+            line = line[:slashInd]
+        yield line
+
+
+class Command:
+    """A single command of the program, classified and split into its fields
+    once. Commands with the same text are parsed once and shared, so a
+    program costs one reference per instruction plus one record per distinct
+    line.
+    """
+
+    __slots__ = ("command_type", "command", "symbol", "dest", "comp", "jump")
+
+    def __init__(self, command: str) -> None:
+        """Classifies the given command and splits it into its fields.
+
+        Args:
+            command (str): a command without white space and comments.
+        """
+        self.command = command
+        self.symbol = "null"
+        self.dest = "null"
+        self.comp = "null"
+        self.jump = "null"
+        if command[0] == "@":
+            self.command_type = A_COMMAND
+            self.symbol = command[1:]
+        elif command[0] == "(":
+            self.command_type = L_COMMAND
+            self.symbol = command[1:len(command) - 1]
+        else:
+            self.command_type = C_COMMAND
+            comp = command
+            if '=' in comp:
+                equalInd = comp.find('=')
+                self.dest = comp[:equalInd]
+                comp = comp[equalInd + 1:]
+            if ';' in comp:
+                semicolonInd = comp.find(';')
+                self.jump = comp[semicolonInd + 1:]
+                comp = comp[:semicolonInd]
+            self.comp = comp
+
 
 class Parser:
     """Encapsulates access to the input code. Reads an assembly program
@@ -16,28 +81,24 @@ class Parser:
     """
 
     def __init__(self, input_file: typing.TextIO) -> None:
-        """Opens the input file and gets ready to parse it.
+        """Opens the input file and gets ready to parse it. Every command is
+        classified and split once, into the list of Command records in
+        self.commands.
 
         Args:
-            input_file (typing.TextIO): input file.
-        """
-        self.input_lines_init = input_file.read().splitlines()
-        self.input_lines = []
-        for line in self.input_lines_init:
-            line = line.replace(" ", "")
-            line = line.replace('\t', "")
-            if line.isspace() or not line:
-                continue
-            if line.startswith("/"):
-                continue
-            if '/' in line:
-                slashInd = line.find('/')
-                line = line[:slashInd]
-                self.input_lines.append(line)
-                continue
-            self.input_lines.append(line)
-
-        self.num_lines = len(self.input_lines)
+            input_file (typing.TextIO): input file. Any iterable of lines
+                works as well.
+        """
+        self.commands = []
+        parsed = {}  # command text -> its shared Command record
+        for line in read_commands(input_file):
+            command = parsed.get(line)
+            if command is None:
+                command = Command(line)
+                parsed[line] = command
+            self.commands.append(command)
+
+        self.num_lines = len(self.commands)
         self.cur_line = 0
 
     def get_cur_line_number(self) -> int:
@@ -46,6 +107,13 @@ class Parser:
         """
         return self.cur_line
 
+    def get_cur_command(self) -> str:
+        """
+        Returns:
+            str: the current command, without white space and comments.
+        """
+        return self.commands[self.cur_line].command
+
     def has_more_commands(self) -> bool:
         """Are there more commands in the input?
 
@@ -72,12 +140,7 @@ class Parser:
             "L_COMMAND" (actually, pseudo-command) for (Xxx) where Xxx is a
             symbol.
         """
-
-        if '@' in self.input_lines[self.cur_line]:
-            return "A_COMMAND"
-        elif self.input_lines[self.cur_line][0] == "(":
-            return "L_COMMAND"
-        return "C_COMMAND"
+        return self.commands[self.cur_line].command_type
 
     def symbol(self) -> str:
         """
@@ -86,13 +149,7 @@ class Parser:
             (Xxx). Should be called only when command_type() is "A_COMMAND" or 
             "L_COMMAND".
         """
-        commandType = self.command_type()
-        if commandType == "A_COMMAND":
-            return self.input_lines[self.cur_line][1:]
-        if commandType == "L_COMMAND":
-            length = len(self.input_lines[self.cur_line])
-            return self.input_lines[self.cur_line][1:length - 1]
-        return "null"
+        return self.commands[self.cur_line].symbol
 
     def dest(self) -> str:
         """
@@ -100,12 +157,7 @@ class Parser:
             str: the dest mnemonic in the current C-command. Should be called 
             only when commandType() is "C_COMMAND".
         """
-        commandType = self.command_type()
-        if commandType == "C_COMMAND" and '=' in self.input_lines[
-            self.cur_line]:
-            equalInd = self.input_lines[self.cur_line].find('=')
-            return self.input_lines[self.cur_line][:equalInd]
-        return "null"
+        return self.commands[self.cur_line].dest
 
     def comp(self) -> str:
         """
@@ -113,24 +165,7 @@ class Parser:
             str: the comp mnemonic in the current C-command. Should be called 
             only when commandType() is "C_COMMAND".
         """
-        commandType = self.command_type()
-        if commandType == "C_COMMAND" and '=' in self.input_lines[
-            self.cur_line]:
-            equalInd = self.input_lines[self.cur_line].find('=')
-            comp = self.input_lines[self.cur_line][equalInd + 1:]
-            if ';' in comp:
-                semicolonInd = comp.find(';')
-                return comp[:semicolonInd]
-
-            return self.input_lines[self.cur_line][equalInd + 1:]
-        elif commandType == "C_COMMAND" and ';' in self.input_lines[
-            self.cur_line]:
-            semicolonInd = self.input_lines[self.cur_line].find(';')
-            return self.input_lines[self.cur_line][:semicolonInd]
-        elif commandType == "C_COMMAND":
-            return self.input_lines[self.cur_line]
-
-        return "null"
+        return self.commands[self.cur_line].comp
 
     def jump(self) -> str:
         """
@@ -138,9 +173,4 @@ class Parser:
             str: the jump mnemonic in the current C-command. Should be called 
             only when commandType() is "C_COMMAND".
         """
-        commandType = self.command_type()
-        if commandType == "C_COMMAND" and ';' in self.input_lines[
-            self.cur_line]:
-            semicolonInd = self.input_lines[self.cur_line].find(';')
-            return self.input_lines[self.cur_line][semicolonInd + 1:]
-        return "null"
+        return self.commands[self.cur_line].jump
@@ -0,0 +1,145 @@
+"""
+This file is part of nand2tetris, as taught in The Hebrew University, and
+was written by Aviv Yaish. It is an extension to the specifications given
+[here](https://www.nand2tetris.org) (Shimon Schocken and Noam Nisan, 2017),
+as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0
+Unported [License](https://creativecommons.org/licenses/by-nc-sa/3.0/).
+"""
+import typing
+from Parser import Command, FUNCTION_COMMAND, CALL_COMMAND, \
+    RETURN_COMMAND, TAIL_CALL_COMMAND
+
+ENTRY_FUNCTION = "Sys.init"
+
+
+class CallGraph:
+    """
+    The call graph of a whole program: which function calls which, built
+    from the call commands of all of its .vm files. Functions are only
+    reached through call commands (the VM has no function pointers), so a
+    function that no path of calls reaches from Sys.init never runs.
+    """
+
+    def __init__(self, files: typing.Dict[str, typing.List[Command]]) -> None:
+        """Builds the call graph of a program.
+
+        Args:
+            files (typing.Dict[str, typing.List[Command]]): the parsed
+                commands of every .vm file of the program, by file name.
+        """
+        self.files = files
+        # function name -> the names of the functions it calls
+        self.calls = {}
+        for commands in files.values():
+            callees = None
+            for command in commands:
+                if command.opcode == FUNCTION_COMMAND:
+                    callees = self.calls.setdefault(command.arg1, set())
+                elif command.opcode == CALL_COMMAND and callees is not None:
+                    callees.add(command.arg1)
+
+    def reachable(self, root: str = ENTRY_FUNCTION) -> typing.Set[str]:
+        """
+        Args:
+            root (str): the function where the program starts.
+
+        Returns:
+            typing.Set[str]: the functions that a path of calls reaches from
+            the root, including the root itself.
+        """
+        reached = {root}
+        pending = [root]
+        while pending:
+            for callee in self.calls.get(pending.pop(), ()):
+                if callee not in reached:
+                    reached.add(callee)
+                    pending.append(callee)
+        return reached
+
+    def drop_unreachable(self, root: str = ENTRY_FUNCTION) -> typing.Tuple[
+            typing.Dict[str, typing.List[Command]], typing.List[str]]:
+        """Removes the functions that are not reachable from the root. If the
+        program has no root function, nothing is removed.
+
+        Args:
+            root (str): the function where the program starts.
+
+        Returns:
+            typing.Tuple[typing.Dict[str, typing.List[Command]],
+            typing.List[str]]: the commands of every file without the
+            unreachable functions, and the names of the removed functions.
+        """
+        if root not in self.calls:
+            return self.files, []
+        reached = self.reachable(root)
+        kept_files = {}
+        dropped = []
+        for file_name, commands in self.files.items():
+            kept = []
+            keep = True  # commands before the first function are kept
+            for command in commands:
+                if command.opcode == FUNCTION_COMMAND:
+                    keep = command.arg1 in reached
+                    if not keep:
+                        dropped.append(command.arg1)
+                if keep:
+                    kept.append(command)
+            kept_files[file_name] = kept
+        return kept_files, dropped
+
+    def arities(self, root: str = ENTRY_FUNCTION) -> typing.Dict[str, int]:
+        """The VM does not declare how many arguments a function takes, but
+        every call site says how many it passes.
+
+        Args:
+            root (str): the function where the program starts, which the
+                bootstrap code calls without arguments.
+
+        Returns:
+            typing.Dict[str, int]: the number of arguments of every function
+            whose call sites all pass the same number of arguments.
+        """
+        passed = {root: {0}}  # function name -> the numbers of arguments
+        for commands in self.files.values():
+            for command in commands:
+                if command.opcode == CALL_COMMAND:
+                    passed.setdefault(command.arg1, set()).add(command.arg2)
+        return {function_name: min(n_args)
+                for function_name, n_args in passed.items()
+                if len(n_args) == 1}
+
+    def mark_tail_calls(self, root: str = ENTRY_FUNCTION) -> typing.Tuple[
+            typing.Dict[str, typing.List[Command]], int]:
+        """Replaces every "call F n; return" with "tail-call F n m", where m
+        is the number of arguments of the calling function, if it is known
+        and at least n (so F can take over the frame of the caller). Other
+        calls are kept as they are.
+
+        Args:
+            root (str): the function where the program starts.
+
+        Returns:
+            typing.Tuple[typing.Dict[str, typing.List[Command]], int]: the
+            commands of every file with the tail calls marked, and the
+            number of tail calls.
+        """
+        arities = self.arities(root)
+        marked_files = {}
+        count = 0
+        for file_name, commands in self.files.items():
+            marked = []
+            caller_args = None
+            for command in commands:
+                if command.opcode == FUNCTION_COMMAND:
+                    caller_args = arities.get(command.arg1)
+                elif command.opcode == RETURN_COMMAND and marked \
+                        and marked[-1].opcode == CALL_COMMAND \
+                        and caller_args is not None \
+                        and marked[-1].arg2 <= caller_args:
+                    call = marked.pop()
+                    command = Command(TAIL_CALL_COMMAND, call.arg1, call.arg2,
+                                      caller_args)
+                    count += 1
+                marked.append(command)
+            marked_files[file_name] = marked
+        return marked_files, count
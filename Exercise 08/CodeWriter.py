@@ -6,6 +6,14 @@ as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0
 Unported [License](https://creativecommons.org/licenses/by-nc-sa/3.0/).
 """
 import typing
+from Parser import ADD_COMMAND, SUB_COMMAND, NEG_COMMAND, EQ_COMMAND, \
+    GT_COMMAND, LT_COMMAND, AND_COMMAND, OR_COMMAND, NOT_COMMAND, \
+    SHIFT_LEFT_COMMAND, SHIFT_RIGHT_COMMAND, PUSH_COMMAND, POP_COMMAND, \
+    CONSTANT_SEGMENT, STATIC_SEGMENT, POINTER_SEGMENT, TEMP_SEGMENT, \
+    LOCAL_SEGMENT, ARGUMENT_SEGMENT, THIS_SEGMENT, THAT_SEGMENT
+from Prologue import LOOP_PROLOGUE, PUSH_ZERO_SIZE, choose_prologue
+from PointerSaves import SAVE_THIS, SAVE_THAT, SAVE_BOTH, SAVE_NAMES, \
+    frame_size
 
 """ constatnts: """
 SP = 0
@@ -16,55 +24,148 @@ THIS = 3
 THAT = 4
 TEMP = 5
 STATIC = 16
-
-ADD_COMMAND = "add"
-SUB_COMMAND = "sub"
-AND_COMMAND = "and"
-OR_COMMAND = "or"
-SHIFT_LEFT_COMMAND = "shiftleft"
-SHIFT_RIGHT_COMMAND = "shiftright"
-NEG_COMMAND = "neg"
-EQ_COMMAND = "eq"
-GT_COMMAND = "gt"
-LT_COMMAND = "lt"
-NOT_COMMAND = "not"
-PUSH_COMMAND = "C_PUSH"
-POP_COMMAND = "C_POP"
-CONSTANT_SEGMENT = "constant"
-STATIC_SEGMENT = "static"
-POINTER_SEGMENT = "pointer"
-TEMP_SEGMENT = "temp"
-LOCAL_SEGMENT = "local"
-ARGUMENT_SEGMENT = "argument"
-THIS_SEGMENT = "this"
-THAT_SEGMENT = "that"
+POINTER_NAMES = {LCL: "LCL", ARG: "ARG", THIS: "THIS", THAT: "THAT"}
+
+""" labels of the routines shared by all call sites: """
+CALL_ROUTINE = "VM$CALL"
+RETURN_ROUTINE = "VM$RETURN"
+COMPARISON_ROUTINES = {EQ_COMMAND: "VM$EQ", GT_COMMAND: "VM$GT",
+                       LT_COMMAND: "VM$LT"}
+TRUE_ROUTINE = "VM$TRUE"
+FALSE_ROUTINE = "VM$FALSE"
+
+""" the scratch registers that returns keep the frame and the return
+    address in, like the shared return routine: """
+FRAME = "R13"
+RETURN_ADDRESS = "R14"
+
+""" operations on the top of the stack, when it is cached in D (x is
+    popped into M, y is in D): """
+CACHED_BINARY_OPERATIONS = {ADD_COMMAND: "D=D+M", SUB_COMMAND: "D=M-D",
+                            AND_COMMAND: "D=D&M", OR_COMMAND: "D=D|M"}
+CACHED_UNARY_OPERATIONS = {NEG_COMMAND: "D=-D", NOT_COMMAND: "D=!D",
+                           SHIFT_LEFT_COMMAND: "D=D<<",
+                           SHIFT_RIGHT_COMMAND: "D=D>>"}
+""" the same operations, when the stack is only in RAM (x is in M after y
+    is popped into D, or the operand is in M): """
+STACK_BINARY_OPERATIONS = {ADD_COMMAND: "M=M+D", SUB_COMMAND: "M=M-D",
+                           AND_COMMAND: "M=M&D", OR_COMMAND: "M=M|D"}
+STACK_UNARY_OPERATIONS = {NEG_COMMAND: "M=-M", NOT_COMMAND: "M=!M",
+                          SHIFT_LEFT_COMMAND: "M=M<<",
+                          SHIFT_RIGHT_COMMAND: "M=M>>"}
+
+
+def frame_pointers(saved: int) -> typing.List[int]:
+    """
+    Args:
+        saved (int): the pointers that a frame saves (a PointerSaves mask).
+
+    Returns:
+        typing.List[int]: the pointers that the frame holds, above the return
+        address, in the order they are pushed.
+    """
+    pointers = [LCL, ARG]
+    if saved & SAVE_THIS:
+        pointers.append(THIS)
+    if saved & SAVE_THAT:
+        pointers.append(THAT)
+    return pointers
+
+
+def routine_label(routine: str, saved: int) -> str:
+    """
+    Args:
+        routine (str): CALL_ROUTINE or RETURN_ROUTINE.
+        saved (int): the pointers that the frames of the routine save.
+
+    Returns:
+        str: the label of the variant of the routine for these frames.
+    """
+    if saved == SAVE_BOTH:
+        return routine
+    return f'{routine}${SAVE_NAMES[saved]}'
+
+
+""" the largest stack pointer change that is written back without D: """
+MAX_INCREMENTED_OFFSET = 3
+""" the largest index that is cheaper to reach by incrementing A: """
+MAX_INCREMENTED_INDEX = 6
+""" the most arguments that a tail call copies with unrolled addressing: """
+MAX_UNROLLED_TAIL_ARGUMENTS = 4
 
 
 class CodeWriter:
     """Translates VM commands into Hack assembly code."""
 
-    """static counter for the labels"""
-    counter_labels = 1
-
-    def __init__(self, output_stream: typing.TextIO) -> None:
+    def __init__(self, output_stream: typing.TextIO,
+                 shared_calls: bool = False,
+                 shared_comparisons: bool = False,
+                 cache_top: bool = False,
+                 virtual_stack: bool = False,
+                 prologue: typing.Optional[str] = None) -> None:
         """Initializes the CodeWriter.
-           Each CodeWriter has counter for the calls, output_stream,
-           file name, cur function.
+           Each CodeWriter has counter for the calls, counter for the
+           labels, output_stream, file name, cur function.
         Args:
             output_stream (typing.TextIO): output stream.
+            shared_calls (bool): if this is True, call and return commands
+                jump to a single shared call routine and a single shared
+                return routine (written by write_init), instead of inlining
+                the whole calling protocol at every use.
+            shared_comparisons (bool): if this is True, eq, gt and lt jump to
+                shared comparison routines (written by write_init), instead
+                of inlining the comparison and its labels at every use.
+            cache_top (bool): if this is True, the top of the stack is kept
+                in D between consecutive stack operations, and only written
+                to RAM[SP] before labels, jumps, calls, returns, and the
+                commands that use D for themselves.
+            virtual_stack (bool): if this is True, the stack pointer is
+                tracked as RAM[SP] plus a known offset between consecutive
+                stack operations, which address the stack slots directly.
+                RAM[SP] is only written back at the same points where the
+                cached top is written.
+            prologue (typing.Optional[str]): the goal ("size" or "speed") of
+                the cost model that picks how function prologues zero their
+                locals. If this is None, every local is pushed as a 0.
         """
         self.call_counter = 1
+        # labels are prefixed by the file name, so every file can count its
+        # labels by itself (and be translated independently)
+        self.counter_labels = 1
         self.output_stream = output_stream
         self.file_name = ""
         self.cur_function = ""
-
-    def write_init(self):
-        """" This method initialize SP to 256 and calls Sys.init. """
+        # the pointers that the frame of the current function saves
+        self.saved = SAVE_BOTH
+        self.shared_calls = shared_calls
+        self.shared_comparisons = shared_comparisons
+        self.cache_top = cache_top
+        self.top_in_d = False
+        self.virtual_stack = virtual_stack
+        self.stack_offset = 0
+        self.prologue = prologue
+        # (function name, locals, zeroed locals, strategy, ROM words)
+        self.prologues = []
+
+    def write_init(self, frames: typing.Iterable[int] = (SAVE_BOTH,)):
+        """" This method initialize SP to 256 and calls Sys.init.
+             With shared calls or comparisons, it also writes the shared
+             routines, right after the call to Sys.init (which never returns).
+             frames are the kinds of frames (PointerSaves masks) that the
+             functions of the program use: every one of them gets its own
+             call and return routines.
+        """
         self.output_stream.write("@256\n")
         self.output_stream.write("D=A\n")
         self.output_stream.write("@SP\n")
         self.output_stream.write("M=D\n")
         self.write_call("Sys.init", 0)
+        if self.shared_calls:
+            for saved in sorted(set(frames) | {SAVE_BOTH}, reverse=True):
+                self.write_call_routine(saved)
+                self.write_return_routine(saved)
+        if self.shared_comparisons:
+            self.write_comparison_routines()
 
     def set_file_name(self, filename: str) -> None:
         """Informs the code writer that the translation of a new VM file is 
@@ -99,7 +200,7 @@ class CodeWriter:
             labels of gt.
          """
         self.output_stream.write(
-            f'({self.file_name}$ifsamesign{CodeWriter.counter_labels})\n')
+            f'({self.file_name}$ifsamesign{self.counter_labels})\n')
         self.output_stream.write("@SP\n")
         self.output_stream.write("M = M - 1\n")  # hold &y
         self.output_stream.write("A = M\n")  # @M ===> @Y
@@ -109,25 +210,25 @@ class CodeWriter:
         self.output_stream.write("A = M\n")  # @X
         self.output_stream.write("D = D - M\n")  # D = Y - X
         self.output_stream.write(
-            f'@{self.file_name}$IFGT{CodeWriter.counter_labels}\n')
+            f'@{self.file_name}$IFGT{self.counter_labels}\n')
         self.output_stream.write("D;JLT\n")
         self.output_stream.write(
-            f'@{self.file_name}$IFNOTGT{CodeWriter.counter_labels}\n')
+            f'@{self.file_name}$IFNOTGT{self.counter_labels}\n')
         self.output_stream.write("0;JMP\n")
 
         self.output_stream.write(
-            f'({self.file_name}$IFGT{CodeWriter.counter_labels})\n')
+            f'({self.file_name}$IFGT{self.counter_labels})\n')
         self.output_stream.write("@SP\n")
         self.output_stream.write("A = M\n")  # goto X
         self.output_stream.write("M = -1\n")  # x =-1
         self.output_stream.write("@SP\n")
         self.output_stream.write("M = M + 1\n")
         self.output_stream.write(
-            f'@{self.file_name}$GTEND{CodeWriter.counter_labels}\n')
+            f'@{self.file_name}$GTEND{self.counter_labels}\n')
         self.output_stream.write("0;JMP\n")
 
         self.output_stream.write(
-            f'({self.file_name}$IFNOTGT{CodeWriter.counter_labels})\n')
+            f'({self.file_name}$IFNOTGT{self.counter_labels})\n')
         self.output_stream.write("@SP\n")
 
         self.output_stream.write("A = M\n")  # goto x
@@ -136,8 +237,8 @@ class CodeWriter:
         self.output_stream.write("M = M + 1\n")
 
         self.output_stream.write(
-            f'({self.file_name}$GTEND{CodeWriter.counter_labels})\n')
-        CodeWriter.counter_labels += 1
+            f'({self.file_name}$GTEND{self.counter_labels})\n')
+        self.counter_labels += 1
 
     def write_gt_y_pos(self):
         """this method is called from the write_gt method. it handles the
@@ -145,7 +246,7 @@ class CodeWriter:
         """
         # y >= 0
         self.output_stream.write(
-            f'({self.file_name}$ifypos{CodeWriter.counter_labels})\n')
+            f'({self.file_name}$ifypos{self.counter_labels})\n')
         self.output_stream.write("@SP\n")
         self.output_stream.write("M = M - 1\n")
         self.output_stream.write("A = M\n")  # @X
@@ -153,14 +254,14 @@ class CodeWriter:
         # now check x
         # if x < 0, so they don't have the same sign
         self.output_stream.write(
-            f'@{self.file_name}$IFNOTGT{CodeWriter.counter_labels}\n')
+            f'@{self.file_name}$IFNOTGT{self.counter_labels}\n')
         self.output_stream.write("D;JLT\n")
 
         self.output_stream.write("@SP\n")
         self.output_stream.write("M = M + 1\n")
         self.output_stream.write("M = M + 1\n")
         self.output_stream.write(
-            f'@{self.file_name}$ifsamesign{CodeWriter.counter_labels}\n')
+            f'@{self.file_name}$ifsamesign{self.counter_labels}\n')
         # x >= 0
         self.output_stream.write("D;JGE\n")
 
@@ -171,13 +272,13 @@ class CodeWriter:
         # y < 0
         # now check if x is pos (y < 0 and x >= 0, so true)
         self.output_stream.write(
-            f'({self.file_name}$ifyneg{CodeWriter.counter_labels})\n')
+            f'({self.file_name}$ifyneg{self.counter_labels})\n')
         self.output_stream.write("@SP\n")
         self.output_stream.write("M = M - 1\n")  # hold &x
         self.output_stream.write("A = M\n")  # @X
         self.output_stream.write("D = M\n")  # D = X
         self.output_stream.write(
-            f'@{self.file_name}$IFGT{CodeWriter.counter_labels}\n')
+            f'@{self.file_name}$IFGT{self.counter_labels}\n')
         self.output_stream.write("D;JGE\n")  # y < 0 and x >= 0, so true
 
         self.output_stream.write("@SP\n")
@@ -185,7 +286,7 @@ class CodeWriter:
         self.output_stream.write("M = M + 1\n")
         # y < 0 and x < 0
         self.output_stream.write(
-            f'@{self.file_name}$ifsamesign{CodeWriter.counter_labels}\n')
+            f'@{self.file_name}$ifsamesign{self.counter_labels}\n')
         self.output_stream.write("0;JMP\n")
 
     def write_gt(self):
@@ -196,10 +297,10 @@ class CodeWriter:
         self.output_stream.write("D = M\n")  # D = Y
 
         self.output_stream.write(
-            f'@{self.file_name}$ifyneg{CodeWriter.counter_labels}\n')
+            f'@{self.file_name}$ifyneg{self.counter_labels}\n')
         self.output_stream.write("D;JLT\n")
         self.output_stream.write(
-            f'@{self.file_name}$ifypos{CodeWriter.counter_labels}\n')
+            f'@{self.file_name}$ifypos{self.counter_labels}\n')
         # y>=0
         self.output_stream.write("D;JGE\n")
 
@@ -255,25 +356,25 @@ class CodeWriter:
         self.output_stream.write("A = M\n")  # @X
         self.output_stream.write("D = D - M\n")  # D = Y - X
         self.output_stream.write(
-            f'@{self.file_name}$IFEQ{CodeWriter.counter_labels}\n')
+            f'@{self.file_name}$IFEQ{self.counter_labels}\n')
         self.output_stream.write("D;JEQ\n")
         self.output_stream.write(
-            f'@{self.file_name}$IFNOTEQ{CodeWriter.counter_labels}\n')
+            f'@{self.file_name}$IFNOTEQ{self.counter_labels}\n')
         self.output_stream.write("0;JMP\n")
 
         self.output_stream.write(
-            f'({self.file_name}$IFEQ{CodeWriter.counter_labels})\n')
+            f'({self.file_name}$IFEQ{self.counter_labels})\n')
         self.output_stream.write("@SP\n")
         self.output_stream.write("A = M\n")  # goto x
         self.output_stream.write("M = -1\n")  # x=-1
         self.output_stream.write("@SP\n")
         self.output_stream.write("M = M + 1\n")
         self.output_stream.write(
-            f'@{self.file_name}$EQEND{CodeWriter.counter_labels}\n')
+            f'@{self.file_name}$EQEND{self.counter_labels}\n')
         self.output_stream.write("0;JMP\n")
 
         self.output_stream.write(
-            f'({self.file_name}$IFNOTEQ{CodeWriter.counter_labels})\n')
+            f'({self.file_name}$IFNOTEQ{self.counter_labels})\n')
         self.output_stream.write("@SP\n")
         self.output_stream.write("A = M\n")  # goto x
         self.output_stream.write("M = 0\n")  # x=0
@@ -281,9 +382,92 @@ class CodeWriter:
         self.output_stream.write("M = M + 1\n")
 
         self.output_stream.write(
-            f'({self.file_name}$EQEND{CodeWriter.counter_labels})\n')
+            f'({self.file_name}$EQEND{self.counter_labels})\n')
 
-        CodeWriter.counter_labels += 1
+        self.counter_labels += 1
+
+    def write_shared_comparison(self, command):
+        """ this method translates eq/gt/lt to a jump to the shared routine of
+            the command, with the return address in D.
+        """
+        self.output_stream.write(
+            f'@{self.file_name}$CMPEND{self.counter_labels}\n')
+        self.output_stream.write("D=A\n")
+        self.output_stream.write(f'@{COMPARISON_ROUTINES[command]}\n')
+        self.output_stream.write("0;JMP\n")
+        self.output_stream.write(
+            f'({self.file_name}$CMPEND{self.counter_labels})\n')
+        self.counter_labels += 1
+
+    def write_comparison_routines(self):
+        """ this method writes the shared eq, gt and lt routines. On entry, D
+            holds the return address, which is kept in R15. They pop y,
+            replace x with the result, and return through the shared true
+            and false tails. gt and lt first compare the signs of x and y, so
+            that x - y is only computed when it can not overflow.
+        """
+        self.output_stream.write(f'({COMPARISON_ROUTINES[EQ_COMMAND]})\n')
+        self.output_stream.write("@R15\n")
+        self.output_stream.write("M=D\n")
+        self.output_stream.write("@SP\n")
+        self.output_stream.write("AM=M-1\n")
+        self.output_stream.write("D=M\n")  # D = Y
+        self.output_stream.write("A=A-1\n")
+        self.output_stream.write("D=M-D\n")  # D = X - Y
+        self.output_stream.write(f'@{TRUE_ROUTINE}\n')
+        self.output_stream.write("D;JEQ\n")
+        self.output_stream.write(f'@{FALSE_ROUTINE}\n')
+        self.output_stream.write("0;JMP\n")
+
+        # gt is true when x >= 0 > y, lt is true when y >= 0 > x
+        for command, if_y_neg, if_y_pos, jump in [
+                (GT_COMMAND, TRUE_ROUTINE, FALSE_ROUTINE, "JGT"),
+                (LT_COMMAND, FALSE_ROUTINE, TRUE_ROUTINE, "JLT")]:
+            routine = COMPARISON_ROUTINES[command]
+            self.output_stream.write(f'({routine})\n')
+            self.output_stream.write("@R15\n")
+            self.output_stream.write("M=D\n")
+            self.output_stream.write("@SP\n")
+            self.output_stream.write("AM=M-1\n")
+            self.output_stream.write("D=M\n")  # D = Y
+            self.output_stream.write(f'@{routine}$YNEG\n')
+            self.output_stream.write("D;JLT\n")
+            # y >= 0
+            self.output_stream.write("@SP\n")
+            self.output_stream.write("A=M-1\n")
+            self.output_stream.write("D=M\n")  # D = X
+            self.output_stream.write(f'@{if_y_pos}\n')
+            self.output_stream.write("D;JLT\n")  # x < 0 <= y
+            self.output_stream.write(f'@{routine}$SAMESIGN\n')
+            self.output_stream.write("0;JMP\n")
+            # y < 0
+            self.output_stream.write(f'({routine}$YNEG)\n')
+            self.output_stream.write("@SP\n")
+            self.output_stream.write("A=M-1\n")
+            self.output_stream.write("D=M\n")  # D = X
+            self.output_stream.write(f'@{if_y_neg}\n')
+            self.output_stream.write("D;JGE\n")  # x >= 0 > y
+            # same sign, so x - y does not overflow
+            self.output_stream.write(f'({routine}$SAMESIGN)\n')
+            self.output_stream.write("@SP\n")
+            self.output_stream.write("A=M\n")
+            self.output_stream.write("D=M\n")  # D = Y
+            self.output_stream.write("A=A-1\n")
+            self.output_stream.write("D=M-D\n")  # D = X - Y
+            self.output_stream.write(f'@{TRUE_ROUTINE}\n')
+            self.output_stream.write(f'D;{jump}\n')
+            self.output_stream.write(f'@{FALSE_ROUTINE}\n')
+            self.output_stream.write("0;JMP\n")
+
+        # the shared tails: x = true/false, and return
+        for routine, value in [(TRUE_ROUTINE, -1), (FALSE_ROUTINE, 0)]:
+            self.output_stream.write(f'({routine})\n')
+            self.output_stream.write("@SP\n")
+            self.output_stream.write("A=M-1\n")
+            self.output_stream.write(f'M={value}\n')
+            self.output_stream.write("@R15\n")
+            self.output_stream.write("A=M\n")
+            self.output_stream.write("0;JMP\n")
 
     def write_and_or(self, command):
         """ This method translates the command and/or to asm """
@@ -296,10 +480,12 @@ class CodeWriter:
         self.output_stream.write(f'M=M{command_dict[command]}D\n')
 
     def write_shifts(self, command):
-        """ this method translates the command shiftleft, shiftright to asm"""
+        """ this method translates the command shiftleft, shiftright to asm.
+            like neg and not, it replaces the top of the stack in place.
+        """
         command_dict = {SHIFT_LEFT_COMMAND: "<<", SHIFT_RIGHT_COMMAND: ">>"}
         self.output_stream.write("@SP\n")
-        self.output_stream.write("AM=M-1\n")
+        self.output_stream.write("A = M - 1\n")
         self.output_stream.write(f'M = M{command_dict[command]}\n')
 
     def write_neg(self):
@@ -314,15 +500,23 @@ class CodeWriter:
         self.output_stream.write("A = M - 1\n")  # hold &y
         self.output_stream.write("M = !M\n")  # @M ===> @Y
 
-    def write_arithmetic(self, command: str) -> None:
+    def write_arithmetic(self, command: int) -> None:
         """Writes assembly code that is the translation of the given 
            arithmetic command. For the commands eq, lt, gt, you should
            correctly compare between all numbers our computer supports,
            and we define the value "true" to be -1, and "false" to be 0.
 
         Args:
-            command (str): an arithmetic command.
+            command (int): the opcode of an arithmetic command.
         """
+        if self.cache_top or self.virtual_stack:
+            if command in CACHED_BINARY_OPERATIONS:
+                self.write_stack_binary(command)
+                return
+            if command in CACHED_UNARY_OPERATIONS:
+                self.write_stack_unary(command)
+                return
+            self.flush_stack()
 
         if command == ADD_COMMAND or command == SUB_COMMAND:
             self.write_arithmetic_add_sub(command)
@@ -330,6 +524,9 @@ class CodeWriter:
         elif command == NEG_COMMAND:
             self.write_neg()
 
+        elif self.shared_comparisons and command in COMPARISON_ROUTINES:
+            self.write_shared_comparison(command)
+
         elif command == EQ_COMMAND:
             self.write_eq()
 
@@ -349,15 +546,18 @@ class CodeWriter:
         elif command == NOT_COMMAND:
             self.write_not()
 
-    def write_push_pop(self, command: str, segment: str, index: int) -> None:
+    def write_push_pop(self, command: int, segment: int, index: int) -> None:
         """Writes assembly code that is the translation of the given 
            command, where command is either C_PUSH or C_POP.
 
         Args:
-            command (str): "C_PUSH" or "C_POP".
-            segment (str): the memory segment to operate on.
+            command (int): the push or the pop opcode.
+            segment (int): the code of the memory segment to operate on.
             index (int): the index in the memory segment.
         """
+        if self.cache_top or self.virtual_stack:
+            self.write_stack_push_pop(command, segment, index)
+            return
         if command == PUSH_COMMAND:
             if segment == CONSTANT_SEGMENT:
                 self.write_push_constant(index)
@@ -379,12 +579,182 @@ class CodeWriter:
                     segment == THIS_SEGMENT or segment == THAT_SEGMENT:
                 self.write_pop_local_arg_this_that(segment, index)
 
+    def write_stack_binary(self, command):
+        """ this method translates add/sub/and/or when the top of the stack
+            is cached in D, or the stack pointer is virtual.
+        """
+        if self.cache_top:
+            self.load_top()
+            self.write_pop_address()
+            self.output_stream.write(
+                f'{CACHED_BINARY_OPERATIONS[command]}\n')
+            return
+        self.write_pop_address()
+        self.output_stream.write("D=M\n")
+        self.output_stream.write("A=A-1\n")
+        self.output_stream.write(f'{STACK_BINARY_OPERATIONS[command]}\n')
+
+    def write_stack_unary(self, command):
+        """ this method translates neg/not/shiftleft/shiftright when the top
+            of the stack is cached in D, or the stack pointer is virtual.
+            like write_neg, write_not and write_shifts, it replaces the top
+            of the stack, so every mode computes the same results.
+        """
+        if self.cache_top:
+            self.load_top()
+            self.output_stream.write(
+                f'{CACHED_UNARY_OPERATIONS[command]}\n')
+            return
+        self.write_top_address(1)
+        self.output_stream.write(f'{STACK_UNARY_OPERATIONS[command]}\n')
+
+    def write_stack_push_pop(self, command, segment, index):
+        """ this method translates push and pop when the top of the stack is
+            cached in D, or the stack pointer is virtual. With a cached top,
+            push spills the old top and loads the new one into D, and pop
+            stores D without touching the stack.
+        """
+        if command == PUSH_COMMAND:
+            self.spill_top()
+            if self.cache_top:
+                self.write_load(segment, index)
+                self.top_in_d = True
+            elif segment == CONSTANT_SEGMENT and -1 <= index <= 1:
+                self.write_push_address()
+                self.output_stream.write(f'M={index}\n')
+            else:
+                self.write_load(segment, index)
+                self.write_push_address()
+                self.output_stream.write("M=D\n")
+            return
+        if self.cache_top:
+            self.load_top()
+            self.top_in_d = False
+        else:
+            self.write_pop_address()
+            self.output_stream.write("D=M\n")
+        if segment == STATIC_SEGMENT or segment == POINTER_SEGMENT or \
+                segment == TEMP_SEGMENT:
+            self.output_stream.write(
+                f'@{self.direct_address(segment, index)}\n')
+            self.output_stream.write("M=D\n")
+            return
+        segment_dict = {LOCAL_SEGMENT: LCL, ARGUMENT_SEGMENT: ARG,
+                        THIS_SEGMENT: THIS, THAT_SEGMENT: THAT}
+        if index <= MAX_INCREMENTED_INDEX:
+            self.output_stream.write(f'@{segment_dict[segment]}\n')
+            self.output_stream.write("A=M\n")
+            for i in range(index):
+                self.output_stream.write("A=A+1\n")
+            self.output_stream.write("M=D\n")
+            return
+        self.output_stream.write("@R13\n")
+        self.output_stream.write("M=D\n")
+        self.write_address(segment, index)
+        self.output_stream.write("@R14\n")
+        self.output_stream.write("M=D\n")
+        self.output_stream.write("@R13\n")
+        self.output_stream.write("D=M\n")
+        self.output_stream.write("@R14\n")
+        self.output_stream.write("A=M\n")
+        self.output_stream.write("M=D\n")
+
+    def write_top_address(self, depth):
+        """ this method sets A to the address of the stack slot that is depth
+            slots below the stack pointer (1 is the top of the stack), and
+            keeps D.
+        """
+        offset = self.stack_offset - depth if self.virtual_stack else -depth
+        self.output_stream.write("@SP\n")
+        if offset == 0:
+            self.output_stream.write("A=M\n")
+        elif offset > 0:
+            self.output_stream.write("A=M+1\n")
+            for i in range(offset - 1):
+                self.output_stream.write("A=A+1\n")
+        else:
+            self.output_stream.write("A=M-1\n")
+            for i in range(-offset - 1):
+                self.output_stream.write("A=A-1\n")
+
+    def write_pop_address(self):
+        """ this method pops the top of the stack, and sets A to its address.
+            D is kept.
+        """
+        if self.virtual_stack:
+            self.write_top_address(1)
+            self.stack_offset -= 1
+        else:
+            self.output_stream.write("@SP\n")
+            self.output_stream.write("AM=M-1\n")
+
+    def write_push_address(self):
+        """ this method pushes a slot on the stack, and sets A to its address.
+            D is kept.
+        """
+        if self.virtual_stack:
+            self.write_top_address(0)
+            self.stack_offset += 1
+        else:
+            self.output_stream.write("@SP\n")
+            self.output_stream.write("M=M+1\n")
+            self.output_stream.write("A=M-1\n")
+
+    def spill_top(self):
+        """ this method writes the top of the stack from D to its stack slot,
+            if it is cached in D.
+        """
+        if self.top_in_d:
+            self.write_push_address()
+            self.output_stream.write("M=D\n")
+            self.top_in_d = False
+
+    def load_top(self):
+        """ this method pops the top of the stack into D, unless it is
+            already cached there. Afterwards it is cached in D.
+        """
+        if not self.top_in_d:
+            self.write_pop_address()
+            self.output_stream.write("D=M\n")
+            self.top_in_d = True
+
+    def write_stack_pointer(self):
+        """ this method writes the virtual stack pointer back to RAM[SP], and
+            keeps D.
+        """
+        offset = self.stack_offset
+        if offset == 0:
+            return
+        self.stack_offset = 0
+        if abs(offset) <= MAX_INCREMENTED_OFFSET:
+            self.output_stream.write("@SP\n")
+            for i in range(abs(offset)):
+                self.output_stream.write(
+                    "M=M+1\n" if offset > 0 else "M=M-1\n")
+            return
+        self.output_stream.write("@R13\n")
+        self.output_stream.write("M=D\n")
+        self.output_stream.write(f'@{abs(offset)}\n')
+        self.output_stream.write("D=A\n")
+        self.output_stream.write("@SP\n")
+        self.output_stream.write("M=M+D\n" if offset > 0 else "M=M-D\n")
+        self.output_stream.write("@R13\n")
+        self.output_stream.write("D=M\n")
+
+    def flush_stack(self):
+        """ this method makes the stack in RAM complete: it writes the cached
+            top to its slot, and the virtual stack pointer to RAM[SP]. It is
+            called where control can merge, and before the commands that use
+            the stack in RAM directly.
+        """
+        self.spill_top()
+        self.write_stack_pointer()
+
     def write_push_constant(self, index):
         """ This method is called when we want to push constant to the
             stack. It translate the command: push constant index to asm.
         """
-        self.output_stream.write(f'@{index}\n')
-        self.output_stream.write("D=A\n")
+        self.write_load_constant(index)
         self.output_stream.write("@SP\n")
         self.output_stream.write("A=M\n")
         self.output_stream.write("M=D\n")
@@ -471,6 +841,124 @@ class CodeWriter:
         self.output_stream.write("A =M\n")
         self.output_stream.write("M =D\n")
 
+    def write_load_constant(self, value):
+        """ this method sets D to a constant. Constants folded by the
+            optimizer may be negative, and are loaded as !(-value-1).
+        """
+        if value < 0:
+            self.output_stream.write(f'@{-value - 1}\n')
+            self.output_stream.write("D=!A\n")
+        else:
+            self.output_stream.write(f'@{value}\n')
+            self.output_stream.write("D=A\n")
+
+    def write_load(self, segment, index):
+        """ this method sets D to the value of a segment entry, without
+            touching the stack.
+        """
+        if segment == CONSTANT_SEGMENT:
+            self.write_load_constant(index)
+        elif segment == LOCAL_SEGMENT or segment == ARGUMENT_SEGMENT or \
+                segment == THIS_SEGMENT or segment == THAT_SEGMENT:
+            segment_dict = {LOCAL_SEGMENT: LCL, ARGUMENT_SEGMENT: ARG,
+                            THIS_SEGMENT: THIS, THAT_SEGMENT: THAT}
+            self.output_stream.write(f'@{segment_dict[segment]}\n')
+            if index == 0:
+                self.output_stream.write("A=M\n")
+            else:
+                self.output_stream.write("D=M\n")
+                self.output_stream.write(f'@{index}\n')
+                self.output_stream.write("A=D+A\n")
+            self.output_stream.write("D=M\n")
+        else:
+            self.output_stream.write(
+                f'@{self.direct_address(segment, index)}\n')
+            self.output_stream.write("D=M\n")
+
+    def write_address(self, segment, index):
+        """ this method sets D to the address of a local, arg, this or that
+            entry.
+        """
+        segment_dict = {LOCAL_SEGMENT: LCL, ARGUMENT_SEGMENT: ARG,
+                        THIS_SEGMENT: THIS, THAT_SEGMENT: THAT}
+        self.output_stream.write(f'@{segment_dict[segment]}\n')
+        self.output_stream.write("D=M\n")
+        if index != 0:
+            self.output_stream.write(f'@{index}\n')
+            self.output_stream.write("D=D+A\n")
+
+    def direct_address(self, segment, index):
+        """ this method returns the symbol or the address of a static,
+            pointer or temp entry.
+        """
+        segment_dict = {STATIC_SEGMENT: f'{self.file_name}.{index}',
+                        POINTER_SEGMENT: f'{POINTER + index}',
+                        TEMP_SEGMENT: f'{TEMP + index}'}
+        return segment_dict[segment]
+
+    def write_move(self, source_segment: int, source_index: int,
+                   segment: int, index: int) -> None:
+        """Writes assembly code that affects the extended command
+        "move source_segment source_index segment index", which is
+        "push source_segment source_index; pop segment index" without the
+        stack.
+
+        Args:
+            source_segment (int): the code of the memory segment to read.
+            source_index (int): the index in the memory segment to read.
+            segment (int): the code of the memory segment to write.
+            index (int): the index in the memory segment to write.
+        """
+        self.spill_top()
+        if segment == STATIC_SEGMENT or segment == POINTER_SEGMENT or \
+                segment == TEMP_SEGMENT:
+            self.write_load(source_segment, source_index)
+            self.output_stream.write(
+                f'@{self.direct_address(segment, index)}\n')
+            self.output_stream.write("M=D\n")
+            return
+        self.write_address(segment, index)
+        self.output_stream.write("@R13\n")
+        self.output_stream.write("M=D\n")
+        self.write_load(source_segment, source_index)
+        self.output_stream.write("@R13\n")
+        self.output_stream.write("A=M\n")
+        self.output_stream.write("M=D\n")
+
+    def write_increment(self, segment: int, index: int, delta: int) -> None:
+        """Writes assembly code that affects the extended command
+        "inc segment index delta", which adds delta to a segment entry in
+        place.
+
+        Args:
+            segment (int): the code of the memory segment to update.
+            index (int): the index in the memory segment.
+            delta (int): the value to add.
+        """
+        self.spill_top()
+        if delta == 1 or delta == -1:
+            update = "M=M+1\n" if delta == 1 else "M=M-1\n"
+        else:
+            update = "M=M+D\n"
+        if segment == STATIC_SEGMENT or segment == POINTER_SEGMENT or \
+                segment == TEMP_SEGMENT:
+            if update == "M=M+D\n":
+                self.write_load_constant(delta)
+            self.output_stream.write(
+                f'@{self.direct_address(segment, index)}\n')
+            self.output_stream.write(update)
+            return
+        self.write_address(segment, index)
+        if update == "M=M+D\n":
+            self.output_stream.write("@R13\n")
+            self.output_stream.write("M=D\n")
+            self.write_load_constant(delta)
+            self.output_stream.write("@R13\n")
+            self.output_stream.write("A=M\n")
+        else:
+            self.output_stream.write("A=D\n")
+        self.output_stream.write(update)
+
     def write_label(self, label: str) -> None:
         """Writes assembly code that affects the label command. 
         Let "Xxx.foo" be a function within the file Xxx.vm. The handling of
@@ -482,6 +970,7 @@ class CodeWriter:
         Args:
             label (str): the label to write.
         """
+        self.flush_stack()
         self.output_stream.write(f'({self.cur_function}${label})\n')
 
     def write_goto(self, label: str) -> None:
@@ -490,6 +979,7 @@ class CodeWriter:
         Args:
             label (str): the label to go to.
         """
+        self.flush_stack()
         self.output_stream.write(f'@{self.cur_function}${label}\n')
         self.output_stream.write("0;JMP\n")
 
@@ -499,13 +989,93 @@ class CodeWriter:
         Args:
             label (str): the label to go to.
         """
-        self.output_stream.write("@SP\n")
-        self.output_stream.write("AM = M-1\n")
-        self.output_stream.write("D = M\n")
+        if self.cache_top or self.virtual_stack:
+            self.load_top()
+            self.top_in_d = False
+            self.write_stack_pointer()
+        else:
+            self.output_stream.write("@SP\n")
+            self.output_stream.write("AM = M-1\n")
+            self.output_stream.write("D = M\n")
         self.output_stream.write(f'@{self.cur_function}${label}\n')
         self.output_stream.write("D;JNE\n")
 
-    def write_function(self, function_name: str, n_vars: int) -> None:
+    def write_compare_branch(self, command: int, negate: bool,
+                             label: str) -> None:
+        """Writes assembly code that affects the sequence
+        "eq|gt|lt; [not]; if-goto label": it pops x and y and jumps to the
+        label if the comparison holds (or, if negate, does not hold), without
+        pushing the boolean first. gt and lt compare the signs of x and y
+        first, so that x - y is only computed when it can not overflow.
+
+        Args:
+            command (int): the eq, gt or lt opcode.
+            negate (bool): True if a not comes before the if-goto.
+            label (str): the label to go to.
+        """
+        self.flush_stack()
+        target = f'{self.cur_function}${label}'
+        if command == EQ_COMMAND:
+            self.output_stream.write("@SP\n")
+            self.output_stream.write("AM=M-1\n")
+            self.output_stream.write("D=M\n")  # D = Y
+            self.output_stream.write("@SP\n")
+            self.output_stream.write("AM=M-1\n")
+            self.output_stream.write("D=M-D\n")  # D = X - Y
+            self.output_stream.write(f'@{target}\n')
+            self.output_stream.write("D;JNE\n" if negate else "D;JEQ\n")
+            return
+
+        prefix = f'{self.file_name}$CMPBR{self.counter_labels}'
+        end = f'{prefix}$END'
+        # where to go when x and y have different signs, and the jump
+        # taken when they have the same sign
+        if command == GT_COMMAND:
+            if_x_neg, if_x_pos, jump = end, target, "JGT"
+            if negate:
+                if_x_neg, if_x_pos, jump = target, end, "JLE"
+        else:
+            if_x_neg, if_x_pos, jump = target, end, "JLT"
+            if negate:
+                if_x_neg, if_x_pos, jump = end, target, "JGE"
+
+        self.output_stream.write("@SP\n")
+        self.output_stream.write("M=M-1\n")
+        self.output_stream.write("M=M-1\n")  # pop y and x
+        self.output_stream.write("A=M+1\n")
+        self.output_stream.write("D=M\n")  # D = Y
+        self.output_stream.write(f'@{prefix}$YNEG\n')
+        self.output_stream.write("D;JLT\n")
+        # y >= 0
+        self.output_stream.write("@SP\n")
+        self.output_stream.write("A=M\n")
+        self.output_stream.write("D=M\n")  # D = X
+        self.output_stream.write(f'@{if_x_neg}\n')
+        self.output_stream.write("D;JLT\n")  # x < 0 <= y
+        self.output_stream.write(f'@{prefix}$SAMESIGN\n')
+        self.output_stream.write("0;JMP\n")
+        # y < 0
+        self.output_stream.write(f'({prefix}$YNEG)\n')
+        self.output_stream.write("@SP\n")
+        self.output_stream.write("A=M\n")
+        self.output_stream.write("D=M\n")  # D = X
+        self.output_stream.write(f'@{if_x_pos}\n')
+        self.output_stream.write("D;JGE\n")  # x >= 0 > y
+        # same sign, so x - y does not overflow
+        self.output_stream.write(f'({prefix}$SAMESIGN)\n')
+        self.output_stream.write("@SP\n")
+        self.output_stream.write("A=M+1\n")
+        self.output_stream.write("D=M\n")  # D = Y
+        self.output_stream.write("A=A-1\n")
+        self.output_stream.write("D=M-D\n")  # D = X - Y
+        self.output_stream.write(f'@{target}\n')
+        self.output_stream.write(f'D;{jump}\n')
+        self.output_stream.write(f'({end})\n')
+        self.counter_labels += 1
+
+    def write_function(self, function_name: str, n_vars: int,
+                       zeroed: typing.Optional[typing.Set[int]] = None,
+                       saved: typing.Optional[int] = None) -> None:
         """Writes assembly code that affects the function command. 
         The handling of each "function Xxx.foo" command within the file Xxx.vm
         generates and injects a symbol "Xxx.foo" into the assembly code stream,
@@ -516,13 +1086,96 @@ class CodeWriter:
         Args:
             function_name (str): the name of the function.
             n_vars (int): the number of local variables of the function.
+            zeroed (typing.Optional[typing.Set[int]]): the locals that the
+                function may read before it writes them. Only these have to
+                be zeroed when a prologue goal is set. None means all.
+            saved (typing.Optional[int]): the pointers that the frame of the
+                function saves, which its returns restore. None means both.
         """
+        self.flush_stack()
         self.cur_function = function_name
+        self.saved = SAVE_BOTH if saved is None else saved
         self.output_stream.write(f'({function_name})\n')
+        if self.prologue is not None:
+            if zeroed is None:
+                zeroed = set(range(n_vars))
+            self.write_prologue(function_name, n_vars, zeroed)
+            return
         for i in range(n_vars):
-            self.write_push_pop(PUSH_COMMAND, "constant", 0)
+            self.write_push_pop(PUSH_COMMAND, CONSTANT_SEGMENT, 0)
+        # the locals are read through LCL, so none of them may stay in D
+        self.spill_top()
+
+    def write_prologue(self, function_name: str, n_vars: int,
+                       zeroed: typing.Set[int]) -> None:
+        """Writes the prologue that the cost model picks: either a loop that
+        zeroes every local, or unrolled code that only zeroes the given
+        locals. Both then set SP to LCL + n_vars.
 
-    def write_call(self, function_name: str, n_args: int) -> None:
+        Args:
+            function_name (str): the name of the function.
+            n_vars (int): the number of local variables of the function.
+            zeroed (typing.Set[int]): the locals that must be zeroed.
+        """
+        strategy, size = choose_prologue(n_vars, zeroed, self.prologue)
+        self.prologues.append(
+            (function_name, n_vars, len(zeroed), strategy, size))
+        if n_vars == 0:
+            return
+        if strategy == LOOP_PROLOGUE:
+            # the labels of the function are "function$label", and a VM
+            # label can not contain '$', so this one can not be among them
+            loop = f'{function_name}$$ZEROLOCALS'
+            self.output_stream.write(f'@{n_vars}\n')
+            self.output_stream.write("D=A\n")
+            self.output_stream.write(f'({loop})\n')
+            self.output_stream.write("@SP\n")
+            self.output_stream.write("AM=M+1\n")
+            self.output_stream.write("A=A-1\n")
+            self.output_stream.write("M=0\n")
+            self.output_stream.write(f'@{loop}\n')
+            self.output_stream.write("D=D-1;JGT\n")
+            return
+        if zeroed:
+            self.output_stream.write("@SP\n")
+            self.output_stream.write("A=M\n")
+            for i in range(max(zeroed) + 1):
+                if i > 0:
+                    self.output_stream.write("A=A+1\n")
+                if i in zeroed:
+                    self.output_stream.write("M=0\n")
+        if zeroed and max(zeroed) == n_vars - 1 and n_vars >= 3:
+            self.output_stream.write("D=A+1\n")
+            self.output_stream.write("@SP\n")
+            self.output_stream.write("M=D\n")
+        elif n_vars <= 3:
+            self.output_stream.write("@SP\n")
+            for i in range(n_vars):
+                self.output_stream.write("M=M+1\n")
+        else:
+            self.output_stream.write(f'@{n_vars}\n')
+            self.output_stream.write("D=A\n")
+            self.output_stream.write("@SP\n")
+            self.output_stream.write("M=M+D\n")
+
+    def prologue_report(self) -> str:
+        """
+        Returns:
+            str: the strategy and the size of every prologue written so far
+            (of functions with locals), next to the size of pushing every
+            local as a 0.
+        """
+        lines = []
+        for function_name, n_vars, zeroed, strategy, size in self.prologues:
+            if n_vars == 0:
+                continue
+            lines.append(f'{function_name}: {n_vars} locals, {zeroed} '
+                         f'zeroed, {strategy}, {size} words (was '
+                         f'{PUSH_ZERO_SIZE * n_vars})')
+        return "\n".join(lines)
+
+    def write_call(self, function_name: str, n_args: int,
+                   saved: typing.Optional[int] = None) -> None:
         """Writes assembly code that affects the call command. 
         Let "Xxx.foo" be a function within the file Xxx.vm.
         The handling of each "call" command within Xxx.foo's code generates and
@@ -537,22 +1190,29 @@ class CodeWriter:
         Args:
             function_name (str): the name of the function to call.
             n_args (int): the number of arguments of the function.
+            saved (typing.Optional[int]): the pointers that the frame of the
+                function saves. None means both.
         """
+        self.flush_stack()
+        saved = SAVE_BOTH if saved is None else saved
+        if self.shared_calls:
+            self.write_shared_call(function_name, n_args, saved)
+            return
         return_address = "return_address"
         self.output_stream.write(
             f'@{self.cur_function}${return_address}.{self.call_counter}\n')
         self.output_stream.write("D=A\n")
         self.push_to_stack()
-        # push LCL, ARG, THIS, THAT
-        seg_arr = [LCL, ARG, THIS, THAT]
+        # push LCL, ARG, THIS, THAT (the ones the frame saves)
+        seg_arr = frame_pointers(saved)
         for seg in seg_arr:
             self.output_stream.write(f'@{seg}\n')
             self.output_stream.write("D = M\n")
             self.push_to_stack()
-        # ARG = SP-5-n_args
+        # ARG = SP-frame size-n_args
         self.output_stream.write("@SP\n")
         self.output_stream.write("D=M\n")
-        self.output_stream.write("@5\n")
+        self.output_stream.write(f'@{frame_size(saved)}\n')
         self.output_stream.write("D=D-A\n")
         self.output_stream.write(f'@{n_args}\n')
         self.output_stream.write("D=D-A\n")
@@ -579,22 +1239,151 @@ class CodeWriter:
         self.output_stream.write("@SP\n")
         self.output_stream.write("M=M+1\n")
 
+    def write_shared_call(self, function_name: str, n_args: int,
+                          saved: int = SAVE_BOTH) -> None:
+        """Writes a call through the shared call routine: R13 = n_args,
+        R14 = the function's address, D = the return address, and a jump to
+        the routine, which does the rest of the calling protocol.
+
+        Args:
+            function_name (str): the name of the function to call.
+            n_args (int): the number of arguments of the function.
+            saved (int): the pointers that the frame of the function saves,
+                which pick the variant of the routine.
+        """
+        return_address = "return_address"
+        # R13 = n_args
+        if n_args == 0 or n_args == 1:
+            self.output_stream.write("@R13\n")
+            self.output_stream.write(f'M={n_args}\n')
+        else:
+            self.output_stream.write(f'@{n_args}\n')
+            self.output_stream.write("D=A\n")
+            self.output_stream.write("@R13\n")
+            self.output_stream.write("M=D\n")
+        # R14 = function_name
+        self.output_stream.write(f'@{function_name}\n')
+        self.output_stream.write("D=A\n")
+        self.output_stream.write("@R14\n")
+        self.output_stream.write("M=D\n")
+        # D = return_address, goto call routine
+        self.output_stream.write(
+            f'@{self.cur_function}${return_address}.{self.call_counter}\n')
+        self.output_stream.write("D=A\n")
+        self.output_stream.write(f'@{routine_label(CALL_ROUTINE, saved)}\n')
+        self.output_stream.write("0;JMP\n")
+        # (return_address)
+        self.output_stream.write(
+            f'({self.cur_function}${return_address}.{self.call_counter})\n')
+        self.call_counter += 1
+
+    def write_call_routine(self, saved: int = SAVE_BOTH) -> None:
+        """Writes the call routine shared by all call sites. On entry, D holds
+        the return address, R13 the number of arguments and R14 the address
+        of the called function. It pushes the return address, LCL, ARG, THIS
+        and THAT, sets ARG = SP-5-n_args and LCL = SP, and jumps to the
+        function.
+
+        Args:
+            saved (int): the pointers that the frames of this variant of the
+                routine save. Without one of THIS and THAT, the frame is a
+                word shorter.
+        """
+        self.output_stream.write(f'({routine_label(CALL_ROUTINE, saved)})\n')
+        self.push_to_stack()
+        # push LCL, ARG, THIS, THAT (the ones the frame saves)
+        seg_arr = frame_pointers(saved)
+        for seg in seg_arr:
+            self.output_stream.write(f'@{seg}\n')
+            self.output_stream.write("D=M\n")
+            self.push_to_stack()
+        # ARG = SP-frame size-n_args
+        self.output_stream.write("@R13\n")
+        self.output_stream.write("D=M\n")
+        self.output_stream.write(f'@{frame_size(saved)}\n')
+        self.output_stream.write("D=D+A\n")
+        self.output_stream.write("@SP\n")
+        self.output_stream.write("D=M-D\n")
+        self.output_stream.write(f'@{ARG}\n')
+        self.output_stream.write("M=D\n")
+        # LCL = SP
+        self.output_stream.write("@SP\n")
+        self.output_stream.write("D=M\n")
+        self.output_stream.write(f'@{LCL}\n')
+        self.output_stream.write("M=D\n")
+        # goto function
+        self.output_stream.write("@R14\n")
+        self.output_stream.write("A=M\n")
+        self.output_stream.write("0;JMP\n")
+
+    def write_return_routine(self, saved: int = SAVE_BOTH) -> None:
+        """Writes the return routine shared by all return commands. It keeps
+        the frame (LCL) in R13 and the return address in R14.
+
+        Args:
+            saved (int): the pointers that the frames of this variant of the
+                routine save, which are the ones it restores.
+        """
+        self.output_stream.write(
+            f'({routine_label(RETURN_ROUTINE, saved)})\n')
+        # frame = LCL
+        self.output_stream.write(f'@{LCL}\n')
+        self.output_stream.write("D=M\n")
+        self.output_stream.write("@R13\n")
+        self.output_stream.write("M=D\n")
+        # return_address = *(frame-frame size)
+        self.output_stream.write(f'@{frame_size(saved)}\n')
+        self.output_stream.write("A=D-A\n")
+        self.output_stream.write("D=M\n")
+        self.output_stream.write("@R14\n")
+        self.output_stream.write("M=D\n")
+        # *ARG = pop()
+        self.output_stream.write("@SP\n")
+        self.output_stream.write("AM=M-1\n")
+        self.output_stream.write("D=M\n")
+        self.output_stream.write(f'@{ARG}\n')
+        self.output_stream.write("A=M\n")
+        self.output_stream.write("M=D\n")
+        # SP = ARG + 1
+        self.output_stream.write(f'@{ARG}\n')
+        self.output_stream.write("D=M+1\n")
+        self.output_stream.write("@SP\n")
+        self.output_stream.write("M=D\n")
+        # THAT, THIS, ARG, LCL = *(frame-1), ..., *(frame-4), without the
+        # pointers that the frame does not save
+        for seg in reversed(frame_pointers(saved)):
+            seg = POINTER_NAMES[seg]
+            self.output_stream.write("@R13\n")
+            self.output_stream.write("AM=M-1\n")
+            self.output_stream.write("D=M\n")
+            self.output_stream.write(f'@{seg}\n')
+            self.output_stream.write("M=D\n")
+        # goto return_address
+        self.output_stream.write("@R14\n")
+        self.output_stream.write("A=M\n")
+        self.output_stream.write("0;JMP\n")
+
     def write_return(self) -> None:
         """Writes assembly code that affects the return command."""
+        self.flush_stack()
+        if self.shared_calls:
+            self.output_stream.write(
+                f'@{routine_label(RETURN_ROUTINE, self.saved)}\n')
+            self.output_stream.write("0;JMP\n")
+            return
         # frame = LCL
         self.output_stream.write(f'@{LCL}\n')
         self.output_stream.write("D=M\n")
-        self.output_stream.write("@frame\n")
+        self.output_stream.write(f'@{FRAME}\n')
         self.output_stream.write("M=D\n")
-        # return_address = *(frame-5)
-        self.output_stream.write("@frame\n")
+        # return_address = *(frame-frame size)
+        self.output_stream.write(f'@{FRAME}\n')
         self.output_stream.write("D = M\n")
-        self.output_stream.write("@5\n")
+        self.output_stream.write(f'@{frame_size(self.saved)}\n')
         self.output_stream.write("D = D - A\n")
         self.output_stream.write("A = D\n")
         self.output_stream.write("D = M\n")  # D = M = *(frame-5)
-        self.output_stream.write(
-            f'@{self.file_name}.{self.cur_function}$return_address\n')
+        self.output_stream.write(f'@{RETURN_ADDRESS}\n')
         self.output_stream.write("M=D\n")
         # *ARG = pop()
         self.output_stream.write("@SP\n")
@@ -616,9 +1405,11 @@ class CodeWriter:
         # THIS = *(frame-2)             // restores THIS for the caller
         # ARG = *(frame-3)              // restores ARG for the caller
         # LCL = *(frame-4)              // restores LCL for the caller
-        seg_dict = {"THAT": 1, "THIS": 2, "ARG": 3, "LCL": 4}
+        # (a shorter frame does not save THIS or THAT, and they move up)
+        seg_dict = {POINTER_NAMES[seg]: offset + 1 for offset, seg in
+                    enumerate(reversed(frame_pointers(self.saved)))}
         for key in seg_dict.keys():
-            self.output_stream.write("@frame\n")
+            self.output_stream.write(f'@{FRAME}\n')
             self.output_stream.write("D = M\n")
             self.output_stream.write(f'@{seg_dict[key]}\n')
             self.output_stream.write("D = D - A\n")
@@ -627,7 +1418,120 @@ class CodeWriter:
             self.output_stream.write(f'@{key}\n')
             self.output_stream.write("M=D\n")
         # goto return_address           // go to the return address
-        self.output_stream.write(
-            f'@{self.file_name}.{self.cur_function}${"return_address"}\n')
+        self.output_stream.write(f'@{RETURN_ADDRESS}\n')
         self.output_stream.write("A=M\n")
         self.output_stream.write("0;JMP\n")
+
+    def write_tail_call(self, function_name: str, n_args: int,
+                        caller_args: int,
+                        saved: typing.Optional[int] = None) -> None:
+        """Writes assembly code that affects the extended command
+        "tail-call function_name n_args caller_args", which is
+        "call function_name n_args; return" in a function of caller_args
+        arguments. The called function reuses the frame of the caller: the
+        arguments are moved down over the arguments of the caller, the
+        saved frame of the caller's caller is moved down right above them
+        (unless it is there already), and LCL and SP point right above it,
+        just like after a call. The called function then returns straight
+        to the caller's caller, so the stack does not grow.
+        With more arguments than the caller has, the frame would have to
+        move up over itself, so a call and a return are written instead.
+        The two functions must save the same pointers, so the frame that is
+        moved is the one that the called function will return through.
+
+        Args:
+            function_name (str): the name of the function to call.
+            n_args (int): the number of arguments of the function.
+            caller_args (int): the number of arguments of the calling
+                function.
+            saved (typing.Optional[int]): the pointers that the frames of
+                both functions save. None means both.
+        """
+        saved = SAVE_BOTH if saved is None else saved
+        if n_args > caller_args:
+            self.write_call(function_name, n_args, saved)
+            self.write_return()
+            return
+        words = frame_size(saved)
+        self.spill_top()
+        # argument i = the stack slot n_args - i below SP
+        if n_args <= MAX_UNROLLED_TAIL_ARGUMENTS:
+            for i in range(n_args):
+                self.write_top_address(n_args - i)
+                self.output_stream.write("D=M\n")
+                self.output_stream.write(f'@{ARG}\n')
+                self.output_stream.write("A=M\n")
+                for j in range(i):
+                    self.output_stream.write("A=A+1\n")
+                self.output_stream.write("M=D\n")
+        else:
+            self.write_stack_pointer()
+            # R13 = SP - n_args, R14 = ARG
+            self.output_stream.write("@SP\n")
+            self.output_stream.write("D=M\n")
+            self.output_stream.write(f'@{n_args}\n')
+            self.output_stream.write("D=D-A\n")
+            self.output_stream.write("@R13\n")
+            self.output_stream.write("M=D\n")
+            self.output_stream.write(f'@{ARG}\n')
+            self.output_stream.write("D=M\n")
+            self.output_stream.write("@R14\n")
+            self.output_stream.write("M=D\n")
+            for i in range(n_args):
+                self.write_copy_word()
+        self.stack_offset = 0
+        if n_args == caller_args:
+            # the frame is in place, SP = LCL
+            self.output_stream.write(f'@{LCL}\n')
+            self.output_stream.write("D=M\n")
+            self.output_stream.write("@SP\n")
+            self.output_stream.write("M=D\n")
+        else:
+            # return address, LCL, ARG, THIS, THAT = *(LCL-5), ..., *(LCL-1)
+            # (the words of the frame), moved down by shift slots, lowest
+            # first
+            shift = caller_args - n_args
+            if shift <= MAX_INCREMENTED_INDEX:
+                for i in range(words):
+                    self.output_stream.write(f'@{LCL}\n')
+                    self.output_stream.write("A=M-1\n")
+                    for j in range(words - 1 - i):
+                        self.output_stream.write("A=A-1\n")
+                    self.output_stream.write("D=M\n")
+                    for j in range(shift):
+                        self.output_stream.write("A=A-1\n")
+                    self.output_stream.write("M=D\n")
+            else:
+                # R13 = LCL - frame size, R14 = ARG + n_args
+                self.output_stream.write(f'@{LCL}\n')
+                self.output_stream.write("D=M\n")
+                self.output_stream.write(f'@{words}\n')
+                self.output_stream.write("D=D-A\n")
+                self.output_stream.write("@R13\n")
+                self.output_stream.write("M=D\n")
+                self.write_address(ARGUMENT_SEGMENT, n_args)
+                self.output_stream.write("@R14\n")
+                self.output_stream.write("M=D\n")
+                for i in range(words):
+                    self.write_copy_word()
+            # A = the address of the last moved word, LCL = SP = A + 1
+            self.output_stream.write("D=A+1\n")
+            self.output_stream.write(f'@{LCL}\n')
+            self.output_stream.write("M=D\n")
+            self.output_stream.write("@SP\n")
+            self.output_stream.write("M=D\n")
+        self.output_stream.write(f'@{function_name}\n')
+        self.output_stream.write("0;JMP\n")
+
+    def write_copy_word(self):
+        """ this method copies RAM[R13] to RAM[R14], increments both, and
+            leaves A at the address that was written.
+        """
+        self.output_stream.write("@R13\n")
+        self.output_stream.write("AM=M+1\n")
+        self.output_stream.write("A=A-1\n")
+        self.output_stream.write("D=M\n")
+        self.output_stream.write("@R14\n")
+        self.output_stream.write("AM=M+1\n")
+        self.output_stream.write("A=A-1\n")
+        self.output_stream.write("M=D\n")
@@ -0,0 +1,128 @@
+"""
+This file is part of nand2tetris, as taught in The Hebrew University, and
+was written by Aviv Yaish. It is an extension to the specifications given
+[here](https://www.nand2tetris.org) (Shimon Schocken and Noam Nisan, 2017),
+as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0
+Unported [License](https://creativecommons.org/licenses/by-nc-sa/3.0/).
+"""
+import hashlib
+import json
+import os
+import typing
+from Parser import Command
+
+CACHE_FILE_NAME = ".vmtranslator_cache.json"
+
+
+class FragmentCache:
+    """
+    Remembers, for every .vm file of a directory, the assembly fragment it
+    was last translated into (and the reports of that translation), together
+    with a hash of what the fragment depends on: the translator version, the
+    options, and the commands that were translated. A file whose hash did not
+    change does not have to be translated again.
+    Every exercise is a standalone tool, so this cache does not share code
+    with the assembler's BuildCache, although both keep JSON next to their
+    inputs. Unlike BuildCache, which checks a built file on disk, the entries
+    here hold the fragments themselves.
+    """
+
+    def __init__(self, directory: str, version: str) -> None:
+        """Reads the fragments that the last build of the directory left
+        behind. If there is no cache file, or it is not a JSON object (say,
+        from an older translator), every file will be translated again.
+
+        Args:
+            directory (str): the directory of the .vm files, where the cache
+                file is kept.
+            version (str): TRANSLATOR_VERSION: fragments that a different
+                version wrote never match a key.
+        """
+        self.cache_path = os.path.join(directory, CACHE_FILE_NAME)
+        self.version = version
+        try:
+            with open(self.cache_path, 'r') as cache_file:
+                self.entries = json.load(cache_file)
+        except (OSError, ValueError):
+            self.entries = {}
+        if not isinstance(self.entries, dict):
+            self.entries = {}
+
+    def key(self, commands: typing.List[Command], options: str = "") -> str:
+        """
+        Args:
+            commands (typing.List[Command]): the commands of a file, as they
+                will be translated. Hashing the parsed commands instead of
+                the file means that whole-program passes (like dropping
+                unused functions) are part of the key as well.
+            options (str): the options that affect the translation.
+
+        Returns:
+            str: a hash of the translator version, the options and the
+            commands.
+        """
+        digest = hashlib.sha256(f'{self.version}\n{options}\n'.encode())
+        for command in commands:
+            digest.update(f'{command}\n'.encode())
+        return digest.hexdigest()
+
+    def load(self, file_name: str, key: str) -> typing.Optional[
+            typing.Tuple[str, typing.List[str]]]:
+        """
+        Args:
+            file_name (str): the name of a .vm file, without the extension.
+            key (str): the current key of the file.
+
+        Returns:
+            typing.Optional[typing.Tuple[str, typing.List[str]]]: the cached
+            fragment and reports of the file, or None if the file was not
+            translated with the same key.
+        """
+        entry = self.entries.get(file_name)
+        if not isinstance(entry, dict) or entry.get("key") != key:
+            return None
+        fragment = entry.get("fragment")
+        reports = entry.get("reports")
+        if not isinstance(fragment, str) or not isinstance(reports, list):
+            return None
+        return fragment, reports
+
+    def record(self, file_name: str, key: str, fragment: str,
+               reports: typing.List[str]) -> None:
+        """Records the translation of a file with the given key.
+
+        Args:
+            file_name (str): the name of a .vm file, without the extension.
+            key (str): the key of the file.
+            fragment (str): the assembly the file was translated into.
+            reports (typing.List[str]): the reports of the translation.
+        """
+        self.entries[file_name] = {
+            "key": key, "fragment": fragment, "reports": reports}
+
+    def prune(self, file_names: typing.Iterable[str]) -> None:
+        """Removes the entries of the files that are not in the program
+        anymore.
+
+        Args:
+            file_names (typing.Iterable[str]): the names of the files of the
+                program.
+        """
+        file_names = set(file_names)
+        for file_name in list(self.entries):
+            if file_name not in file_names:
+                del self.entries[file_name]
+
+    def save(self) -> None:
+        """Stores the fragments for the next build. They are written to a
+        temporary file first, which then replaces the cache file, so a
+        translation that is stopped halfway leaves the old cache. If the
+        directory is not writable, the build just goes without a cache.
+        """
+        temp_path = self.cache_path + ".tmp"
+        try:
+            with open(temp_path, 'w') as cache_file:
+                json.dump(self.entries, cache_file, indent=1, sort_keys=True)
+            os.replace(temp_path, self.cache_path)
+        except OSError:
+            pass
@@ -0,0 +1,188 @@
+"""
+This file is part of nand2tetris, as taught in The Hebrew University, and
+was written by Aviv Yaish. It is an extension to the specifications given
+[here](https://www.nand2tetris.org) (Shimon Schocken and Noam Nisan, 2017),
+as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0
+Unported [License](https://creativecommons.org/licenses/by-nc-sa/3.0/).
+"""
+import sys
+import typing
+from array import array
+
+""" encodings of the C-instruction fields, as in the assembler: """
+DEST_CODES = {"": 0b000, "null": 0b000, "M": 0b001,
+              "D": 0b010, "MD": 0b011, "A": 0b100,
+              "AM": 0b101, "AD": 0b110, "AMD": 0b111}
+
+COMP_CODES = {"0": 0b0101010, "1": 0b0111111, "-1": 0b0111010,
+              "D": 0b0001100, "A": 0b0110000, "!D": 0b0001101,
+              "!A": 0b0110001, "-D": 0b0001111, "-A": 0b0110011,
+              "D+1": 0b0011111, "A+1": 0b0110111, "D-1": 0b0001110,
+              "A-1": 0b0110010, "D+A": 0b0000010, "D-A": 0b0010011,
+              "A-D": 0b0000111, "D&A": 0b0000000, "D|A": 0b0010101,
+              "M": 0b1110000, "!M": 0b1110001, "-M": 0b1110011,
+              "M+1": 0b1110111, "M-1": 0b1110010, "D+M": 0b1000010,
+              "D-M": 0b1010011, "M-D": 0b1000111, "D&M": 0b1000000,
+              "D|M": 0b1010101,
+              # the commuted forms, which the CodeWriter uses as well
+              "A+D": 0b0000010, "A&D": 0b0000000, "A|D": 0b0010101,
+              "M+D": 0b1000010, "M&D": 0b1000000, "M|D": 0b1010101,
+              "A<<": 0b0100000, "D<<": 0b0110000, "M<<": 0b1100000,
+              "A>>": 0b0000000, "D>>": 0b0010000, "M>>": 0b1000000}
+
+JUMP_CODES = {"": 0b000, "null": 0b000, "JGT": 0b001,
+              "JEQ": 0b010, "JGE": 0b011, "JLT": 0b100,
+              "JNE": 0b101, "JLE": 0b110, "JMP": 0b111}
+
+C_PREFIX = 0b111 << 13
+SHIFT_PREFIX = 0b101 << 13
+
+PREDEFINED_SYMBOLS = {"SP": 0, "LCL": 1, "ARG": 2, "THIS": 3, "THAT": 4,
+                      "SCREEN": 16384, "KBD": 24576}
+PREDEFINED_SYMBOLS.update((f'R{register}', register)
+                          for register in range(16))
+FIRST_VARIABLE = 16
+
+""" kinds of decoded lines: """
+NO_INSTRUCTION = 0
+WORD = 1
+SYMBOL = 2
+LABEL = 3
+
+
+def c_instruction(command: str) -> int:
+    """
+    Args:
+        command (str): a C-instruction without white space and comments.
+
+    Returns:
+        int: the 16-bit binary code of the given instruction.
+    """
+    dest, equals, comp = command.rpartition('=')
+    comp, semicolon, jump = comp.partition(';')
+    prefix = SHIFT_PREFIX if '<' in comp or '>' in comp else C_PREFIX
+    return prefix | COMP_CODES[comp] << 6 | DEST_CODES[dest] << 3 \
+        | JUMP_CODES[jump]
+
+
+def decode_line(line: str) -> typing.Tuple[int, typing.Union[int, str]]:
+    """Classifies a line of assembly, exactly like the assembler reads it:
+    white space and comments are ignored.
+
+    Args:
+        line (str): a line of assembly.
+
+    Returns:
+        typing.Tuple[int, typing.Union[int, str]]: (NO_INSTRUCTION, ""),
+        (WORD, the encoded instruction), (SYMBOL, the symbol of an
+        A-instruction) or (LABEL, the declared label).
+    """
+    line = "".join(line.split())
+    if '/' in line:
+        line = line[:line.find('/')]
+    if not line:
+        return NO_INSTRUCTION, ""
+    if line[0] == "@":
+        if line[1:].isnumeric():
+            return WORD, int(line[1:])
+        return SYMBOL, line[1:]
+    if line[0] == "(":
+        return LABEL, line[1:-1]
+    return WORD, c_instruction(line)
+
+
+class HackEncoder:
+    """
+    A sink for the assembly that the CodeWriter writes, which encodes it
+    into machine code as it arrives, so the translator can write a .hack
+    without an .asm file and a run of the assembler in between. It has the
+    write method of a text file, so it can replace the output stream of a
+    CodeWriter, and fragments can be written into it as well.
+    Labels are resolved with fixups, exactly like the single-pass assembler
+    does, so the machine code is the same as the assembler's.
+    """
+
+    """static cache of decoded lines, keyed by the line: the CodeWriter
+    writes the same few lines over and over"""
+    decoded_lines = {}
+
+    def __init__(self) -> None:
+        """Creates an encoder with an empty program."""
+        self.instructions = array('H')
+        self.symbols = dict(PREDEFINED_SYMBOLS)
+        self.fixups = {}  # symbol -> positions of the @symbol instructions
+        self.partial_line = ""
+
+    def write(self, text: str) -> int:
+        """Encodes assembly. The text may end in the middle of a line, which
+        is completed by the next write.
+
+        Args:
+            text (str): lines of assembly.
+
+        Returns:
+            int: the number of characters written.
+        """
+        lines = (self.partial_line + text).split("\n")
+        self.partial_line = lines.pop()
+        decoded_lines = HackEncoder.decoded_lines
+        instructions = self.instructions
+        for line in lines:
+            decoded = decoded_lines.get(line)
+            if decoded is None:
+                decoded = decoded_lines[line] = decode_line(line)
+            kind, value = decoded
+            if kind == WORD:
+                instructions.append(value)
+            elif kind == SYMBOL:
+                address = self.symbols.get(value)
+                if address is None:
+                    self.fixups.setdefault(value, []).append(
+                        len(instructions))
+                    address = 0
+                instructions.append(address)
+            elif kind == LABEL:
+                self.symbols[value] = len(instructions)
+        return len(text)
+
+    def finish(self) -> array:
+        """Resolves the symbols that were used before they were declared.
+        The ones that were never declared are variables, and get the
+        addresses 16, 17, ... in the order in which they first appear.
+
+        Returns:
+            array: the machine code, one unsigned 16-bit word ('H') per
+            instruction.
+        """
+        if self.partial_line:
+            self.write("\n")
+        next_variable = FIRST_VARIABLE
+        for symbol, positions in self.fixups.items():
+            address = self.symbols.get(symbol)
+            if address is None:
+                address = self.symbols[symbol] = next_variable
+                next_variable += 1
+            for position in positions:
+                self.instructions[position] = address
+        self.fixups = {}
+        return self.instructions
+
+    def save(self, output_file: typing.IO, binary: bool = False) -> None:
+        """Writes the machine code in one of the formats of the assembler.
+
+        Args:
+            output_file (typing.IO): writes all output to this file.
+            binary (bool): if this is True, the output is written as packed
+                little-endian 16-bit words and output_file must be opened in
+                binary mode. Otherwise one line of 16 '0'/'1' characters is
+                written per instruction.
+        """
+        instructions = self.finish()
+        if not binary:
+            output_file.write("".join(
+                [f'{instruction:016b}\n' for instruction in instructions]))
+            return
+        if sys.byteorder == "big":
+            instructions = array('H', instructions)
+            instructions.byteswap()
+        output_file.write(instructions.tobytes())
@@ -0,0 +1,367 @@
+"""
+This file is part of nand2tetris, as taught in The Hebrew University, and
+was written by Aviv Yaish. It is an extension to the specifications given
+[here](https://www.nand2tetris.org) (Shimon Schocken and Noam Nisan, 2017),
+as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0
+Unported [License](https://creativecommons.org/licenses/by-nc-sa/3.0/).
+"""
+import typing
+from Parser import Command, LAST_ARITHMETIC_COMMAND, NEG_COMMAND, \
+    NOT_COMMAND, SHIFT_LEFT_COMMAND, SHIFT_RIGHT_COMMAND, PUSH_COMMAND, \
+    POP_COMMAND, LABEL_COMMAND, IF_COMMAND, GOTO_COMMAND, CALL_COMMAND, \
+    FUNCTION_COMMAND, RETURN_COMMAND, MOVE_COMMAND, INCREMENT_COMMAND, \
+    CONSTANT_SEGMENT, STATIC_SEGMENT, POINTER_SEGMENT, LOCAL_SEGMENT, \
+    ARGUMENT_SEGMENT
+from CallGraph import CallGraph
+from Prologue import function_body, locals_read_before_written
+
+UNARY_COMMANDS = (NEG_COMMAND, NOT_COMMAND, SHIFT_LEFT_COMMAND,
+                  SHIFT_RIGHT_COMMAND)
+
+""" reasons for not inlining a function that fits the budget: """
+RECURSIVE = "it is recursive"
+UNBALANCED_STACK = "its stack depth is not known at every return"
+FOREIGN_STATICS = "it uses the statics of its own file"
+MISSING_ARGUMENTS = "it reads more arguments than it is called with"
+
+
+def written_pointers(body: typing.List[Command]) -> typing.List[int]:
+    """
+    Args:
+        body (typing.List[Command]): the commands of a function.
+
+    Returns:
+        typing.List[int]: the pointer entries (0 for THIS, 1 for THAT) that
+        the function sets.
+    """
+    written = set()
+    for command in body:
+        if command.opcode == POP_COMMAND or \
+                command.opcode == INCREMENT_COMMAND:
+            if command.arg1 == POINTER_SEGMENT:
+                written.add(command.arg2)
+        elif command.opcode == MOVE_COMMAND:
+            if command.arg3 == POINTER_SEGMENT:
+                written.add(command.arg4)
+    return sorted(written)
+
+
+def stack_effect(command: Command) -> int:
+    """
+    Args:
+        command (Command): a command that is not a jump or a return.
+
+    Returns:
+        int: the number of values the command adds to the stack.
+    """
+    opcode = command.opcode
+    if opcode <= LAST_ARITHMETIC_COMMAND:
+        return 0 if opcode in UNARY_COMMANDS else -1
+    if opcode == PUSH_COMMAND:
+        return 1
+    if opcode == POP_COMMAND:
+        return -1
+    if opcode == CALL_COMMAND:
+        return 1 - command.arg2
+    return 0
+
+
+def returns_one_value(body: typing.List[Command]) -> bool:
+    """Checks that the stack of a function holds exactly the returned value
+    at every return, so the body can run on the stack of its caller. The
+    depth is followed through the body, and every label must be reached with
+    the same depth by all of its jumps and by the command before it.
+
+    Args:
+        body (typing.List[Command]): the commands of a function.
+
+    Returns:
+        bool: True if the depth is 1 at every return, and the body never
+        pops values that it did not push or falls through its end.
+    """
+    at_label = {}  # label -> the depth of the stack at it
+    depth = 0
+    for command in body:
+        opcode = command.opcode
+        if opcode == LABEL_COMMAND:
+            expected = at_label.setdefault(command.arg1, depth)
+            if depth is None:
+                depth = expected
+            elif expected != depth:
+                return False
+            continue
+        if depth is None:
+            continue  # unreachable
+        if opcode == RETURN_COMMAND:
+            if depth != 1:
+                return False
+            depth = None
+            continue
+        if opcode == IF_COMMAND:
+            depth -= 1
+            if depth < 0:
+                return False
+        if opcode == IF_COMMAND or opcode == GOTO_COMMAND:
+            if at_label.setdefault(command.arg1, depth) != depth:
+                return False
+            if opcode == GOTO_COMMAND:
+                depth = None
+            continue
+        depth += stack_effect(command)
+        if depth < 0:
+            return False
+    return depth is None and None not in at_label.values()
+
+
+class Inliner:
+    """
+    A whole-program pass that copies the bodies of small functions into
+    their callers, instead of calling them. At a call site of f with n
+    arguments and k locals, the caller gets n + k more locals (and one more
+    for each of THIS and THAT that f sets):
+    - the arguments are popped from the stack into the first n of them,
+    - the locals of f that it may read before it writes them are zeroed,
+    - THIS and THAT are saved, if f sets them,
+    - the body of f follows, with "argument i" replaced by "local base+i",
+      "local j" by "local base+n+j", and its labels renamed,
+    - every return jumps to the end of the copy, with the returned value
+      on the stack, just like after the call, and
+    - THIS and THAT are restored there, just like the return would.
+    The copies are made from the original bodies, so they may still call
+    other functions, but are never inlined into each other. A function is
+    not inlined if a call would behave differently: if it uses statics and
+    the caller is in another file, or if its stack is not balanced.
+    Recursive functions are not inlined either.
+    """
+
+    def __init__(self, files: typing.Dict[str, typing.List[Command]],
+                 budget: int) -> None:
+        """Prepares to inline the functions of a program.
+
+        Args:
+            files (typing.Dict[str, typing.List[Command]]): the parsed
+                commands of every .vm file of the program, by file name.
+            budget (int): the largest number of VM commands of a function
+                that is inlined.
+        """
+        self.files = files
+        self.budget = budget
+        self.call_graph = CallGraph(files)
+        # function name -> (its file name, its locals, its body)
+        self.functions = {}
+        for file_name, commands in files.items():
+            for position, command in enumerate(commands):
+                if command.opcode == FUNCTION_COMMAND:
+                    self.functions[command.arg1] = (
+                        file_name, command.arg2,
+                        function_body(commands, position + 1))
+        # function name -> the reason it is not inlined (at some call site)
+        self.rejected = {}
+        self.candidates = set()
+        # function name -> the number of call sites it was inlined at
+        self.inlined = {}
+        # function name -> the number of arguments and the commands before
+        # its body at its first call site
+        self.glue = {}
+        self.sites = 0
+        self.commands_before = 0
+        self.commands_after = 0
+
+    def candidate(self, function_name: str) -> bool:
+        """Checks whether a function fits the budget and can be inlined
+        into any caller, and records the reason if it cannot.
+
+        Args:
+            function_name (str): the name of a function.
+
+        Returns:
+            bool: True if the function may be inlined.
+        """
+        if function_name in self.candidates:
+            return True
+        if function_name not in self.functions \
+                or function_name in self.rejected:
+            return False
+        file_name, n_vars, body = self.functions[function_name]
+        if len(body) > self.budget:
+            return False
+        reason = None
+        if any(
+                function_name in self.call_graph.reachable(callee)
+                for callee in self.call_graph.calls.get(function_name, ())):
+            reason = RECURSIVE
+        if reason is None and not returns_one_value(body):
+            reason = UNBALANCED_STACK
+        if reason is not None:
+            self.rejected[function_name] = reason
+            return False
+        self.candidates.add(function_name)
+        return True
+
+    def site_rejection(self, caller_file: str, function_name: str,
+                       n_args: int) -> typing.Optional[str]:
+        """
+        Args:
+            caller_file (str): the name of the file of the caller.
+            function_name (str): the name of a candidate function.
+            n_args (int): the number of arguments of the call.
+
+        Returns:
+            typing.Optional[str]: the reason the function cannot be inlined
+            at this call site, or None if it can.
+        """
+        file_name, n_vars, body = self.functions[function_name]
+        for command in body:
+            segments = (command.arg1, command.arg3) \
+                if command.opcode == MOVE_COMMAND else (command.arg1,)
+            if command.opcode not in (PUSH_COMMAND, POP_COMMAND,
+                                      MOVE_COMMAND, INCREMENT_COMMAND):
+                continue
+            if STATIC_SEGMENT in segments and caller_file != file_name:
+                return FOREIGN_STATICS
+            if command.arg1 == ARGUMENT_SEGMENT and command.arg2 >= n_args \
+                    or command.opcode == MOVE_COMMAND \
+                    and command.arg3 == ARGUMENT_SEGMENT \
+                    and command.arg4 >= n_args:
+                return MISSING_ARGUMENTS
+        return None
+
+    def inline(self) -> typing.Dict[str, typing.List[Command]]:
+        """
+        Returns:
+            typing.Dict[str, typing.List[Command]]: the commands of every
+            file, with the chosen calls replaced by the bodies of the called
+            functions.
+        """
+        inlined_files = {}
+        for file_name, commands in self.files.items():
+            output = []
+            header = None  # the position of the current function command
+            base = extra = 0
+            for command in commands:
+                if command.opcode == FUNCTION_COMMAND:
+                    self.extend_locals(output, header, extra)
+                    header = len(output)
+                    base = command.arg2
+                    extra = 0
+                elif command.opcode == CALL_COMMAND and header is not None \
+                        and self.candidate(command.arg1):
+                    reason = self.site_rejection(file_name, command.arg1,
+                                                 command.arg2)
+                    if reason is None:
+                        extra = max(extra, self.write_copy(
+                            output, command.arg1, command.arg2, base))
+                        continue
+                    self.rejected.setdefault(command.arg1, reason)
+                output.append(command)
+            self.extend_locals(output, header, extra)
+            inlined_files[file_name] = output
+            self.commands_before += len(commands)
+            self.commands_after += len(output)
+        return inlined_files
+
+    @staticmethod
+    def extend_locals(output: typing.List[Command],
+                      header: typing.Optional[int], extra: int) -> None:
+        """Adds locals to a function, for the copies inlined into it.
+
+        Args:
+            output (typing.List[Command]): the commands written so far.
+            header (typing.Optional[int]): the position of the function
+                command in the output.
+            extra (int): the number of locals to add.
+        """
+        if header is not None and extra:
+            function = output[header]
+            output[header] = Command(FUNCTION_COMMAND, function.arg1,
+                                     function.arg2 + extra)
+
+    def write_copy(self, output: typing.List[Command], function_name: str,
+                   n_args: int, base: int) -> int:
+        """Writes a copy of the body of a function in place of a call.
+
+        Args:
+            output (typing.List[Command]): the commands written so far.
+            function_name (str): the name of the called function.
+            n_args (int): the number of arguments of the call.
+            base (int): the first local of the caller that the copy uses.
+
+        Returns:
+            int: the number of locals of the caller that the copy uses.
+        """
+        file_name, n_vars, body = self.functions[function_name]
+        self.sites += 1
+        self.inlined[function_name] = self.inlined.get(function_name, 0) + 1
+        prefix = f'{function_name}$inline{self.sites}$'
+        segments = {ARGUMENT_SEGMENT: base, LOCAL_SEGMENT: base + n_args}
+        saved = base + n_args + n_vars  # the first local saving a pointer
+        pointers = written_pointers(body)
+
+        glue = [Command(POP_COMMAND, LOCAL_SEGMENT, base + i)
+                for i in reversed(range(n_args))]
+        for i in sorted(locals_read_before_written(body, n_vars)):
+            glue.append(Command(PUSH_COMMAND, CONSTANT_SEGMENT, 0))
+            glue.append(Command(POP_COMMAND, LOCAL_SEGMENT, base + n_args + i))
+        for i, pointer in enumerate(pointers):
+            glue.append(Command(PUSH_COMMAND, POINTER_SEGMENT, pointer))
+            glue.append(Command(POP_COMMAND, LOCAL_SEGMENT, saved + i))
+        self.glue.setdefault(function_name, (n_args, glue))
+        output += glue
+
+        # the renamed labels of the body all start with the prefix, so a
+        # label without it can not be one of them, whatever the body names
+        end = f'{function_name}$inline{self.sites}.end'
+        jumps_to_end = False
+        for position, command in enumerate(body):
+            opcode = command.opcode
+            if opcode == RETURN_COMMAND:
+                if position < len(body) - 1:
+                    output.append(Command(GOTO_COMMAND, end))
+                    jumps_to_end = True
+                continue
+            if opcode == LABEL_COMMAND or opcode == GOTO_COMMAND \
+                    or opcode == IF_COMMAND:
+                command = Command(opcode, prefix + command.arg1)
+            elif opcode == PUSH_COMMAND or opcode == POP_COMMAND \
+                    or opcode == INCREMENT_COMMAND:
+                if command.arg1 in segments:
+                    command = Command(opcode, LOCAL_SEGMENT,
+                                      segments[command.arg1] + command.arg2,
+                                      command.arg3)
+            elif opcode == MOVE_COMMAND:
+                source, source_index = command.arg1, command.arg2
+                target, target_index = command.arg3, command.arg4
+                if source in segments:
+                    source, source_index = \
+                        LOCAL_SEGMENT, segments[source] + source_index
+                if target in segments:
+                    target, target_index = \
+                        LOCAL_SEGMENT, segments[target] + target_index
+                command = Command(opcode, source, source_index, target,
+                                  target_index)
+            output.append(command)
+        if jumps_to_end:
+            output.append(Command(LABEL_COMMAND, end))
+        for i, pointer in enumerate(pointers):
+            output.append(Command(PUSH_COMMAND, LOCAL_SEGMENT, saved + i))
+            output.append(Command(POP_COMMAND, POINTER_SEGMENT, pointer))
+        return n_args + n_vars + len(pointers)
+
+    def report(self) -> str:
+        """
+        Returns:
+            str: the functions that were inlined and at how many call sites,
+            and the reasons the others that fit the budget were not.
+        """
+        lines = [f'{self.sites} calls inlined: {self.commands_before} -> '
+                 f'{self.commands_after} VM commands']
+        for function_name in sorted(set(self.inlined) | set(self.rejected)):
+            line = f'    {function_name}: '
+            if function_name in self.inlined:
+                line += f'inlined {self.inlined[function_name]}x'
+                if function_name in self.rejected:
+                    line += ', but not at the others: '
+            else:
+                line += 'not inlined: '
+            lines.append(line + self.rejected.get(function_name, ""))
+        return "\n".join(lines)
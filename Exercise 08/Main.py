@@ -5,89 +5,492 @@ was written by Aviv Yaish. It is an extension to the specifications given
 as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0
 Unported [License](https://creativecommons.org/licenses/by-nc-sa/3.0/).
 """
+import argparse
+import concurrent.futures
+import io
 import os
 import sys
 import typing
-from Parser import Parser
+from Parser import Parser, Command, LAST_ARITHMETIC_COMMAND, EQ_COMMAND, \
+    GT_COMMAND, LT_COMMAND, NOT_COMMAND, PUSH_COMMAND, \
+    POP_COMMAND, LABEL_COMMAND, IF_COMMAND, GOTO_COMMAND, CALL_COMMAND, \
+    FUNCTION_COMMAND, RETURN_COMMAND, MOVE_COMMAND, INCREMENT_COMMAND, \
+    TAIL_CALL_COMMAND
 from CodeWriter import CodeWriter
+from Optimizer import Optimizer
+from CallGraph import CallGraph
+from Inliner import Inliner
+from RamLayout import RamLayout
+from FragmentCache import FragmentCache
+from HackEncoder import HackEncoder
+from Prologue import SIZE_GOAL, SPEED_GOAL, function_body, \
+    locals_read_before_written
+from PointerSaves import SAVE_BOTH, plan_pointer_saves, mark_pointer_saves, \
+    frames_used, pointer_saves_report
 
-ARITHMETIC_COMMAND = "C_ARITHMETIC"
-PUSH_COMMAND = "C_PUSH"
-POP_COMMAND = "C_POP"
-LABEL_COMMAND = "C_LABEL"
-IF_COMMAND = "C_IF"
-GOTO_COMMAND = "C_GOTO"
-CALL_COMMAND = "C_CALL"
-FUNCTION_COMMAND = "C_FUNCTION"
-RETURN_COMMAND = "C_RETURN"
+COMPARISON_COMMANDS = (EQ_COMMAND, GT_COMMAND, LT_COMMAND)
 
+# Change this whenever the generated code changes, to invalidate the
+# fragments that older versions cached.
+TRANSLATOR_VERSION = "4"
 
-def translate_file(
-        input_file: typing.TextIO, output_file: typing.TextIO,
-        bootstrap: bool) -> None:
-    """Translates a single file.
+
+def translate_commands(commands: typing.List[Command],
+                       code_writer: CodeWriter, bootstrap: bool,
+                       fuse_branches: bool = False) -> None:
+    """Translates the parsed commands of a single file.
 
     Args:
-        input_file (typing.TextIO): the file to translate.
-        output_file (typing.TextIO): writes all output to this file.
+        commands (typing.List[Command]): the commands to translate.
+        code_writer (CodeWriter): writes the translation of the file.
         bootstrap (bool): if this is True, the current file is the 
             first file we are translating.
+        fuse_branches (bool): if this is True, "eq|gt|lt; [not]; if-goto"
+            is translated as a single compare-and-jump.
     """
-    parser = Parser(input_file)
-    code_writer = CodeWriter(output_file)
-    code_writer.set_file_name(os.path.basename(input_file.name).split(".")[0])
-
     if bootstrap:
         code_writer.write_init()
 
-    while parser.has_more_commands():
-        command_type = parser.command_type()
-        if command_type == ARITHMETIC_COMMAND:
-            code_writer.write_arithmetic(parser.get_cur_command())
-
-        elif command_type == PUSH_COMMAND or command_type == POP_COMMAND:
-            code_writer.write_push_pop(command_type, parser.arg1()
-                                       , parser.arg2())
-        elif command_type == LABEL_COMMAND:
-            code_writer.write_label(parser.arg1())
-        elif command_type == GOTO_COMMAND:
-            code_writer.write_goto(parser.arg1())
-        elif command_type == IF_COMMAND:
-            code_writer.write_if(parser.arg1())
-        elif command_type == FUNCTION_COMMAND:
-            code_writer.write_function(parser.arg1(), parser.arg2())
-        elif command_type == CALL_COMMAND:
-            code_writer.write_call(parser.arg1(), parser.arg2())
-        elif command_type == RETURN_COMMAND:
+    num_commands = len(commands)
+    cur_command = 0
+    while cur_command < num_commands:
+        command = commands[cur_command]
+        cur_command += 1
+        opcode = command.opcode
+        if opcode <= LAST_ARITHMETIC_COMMAND:
+            if fuse_branches and opcode in COMPARISON_COMMANDS:
+                branch = cur_command
+                if branch < num_commands \
+                        and commands[branch].opcode == NOT_COMMAND:
+                    branch += 1
+                if branch < num_commands \
+                        and commands[branch].opcode == IF_COMMAND:
+                    code_writer.write_compare_branch(
+                        opcode, branch > cur_command, commands[branch].arg1)
+                    cur_command = branch + 1
+                    continue
+            code_writer.write_arithmetic(opcode)
+        elif opcode == PUSH_COMMAND or opcode == POP_COMMAND:
+            code_writer.write_push_pop(opcode, command.arg1, command.arg2)
+        elif opcode == LABEL_COMMAND:
+            code_writer.write_label(command.arg1)
+        elif opcode == GOTO_COMMAND:
+            code_writer.write_goto(command.arg1)
+        elif opcode == IF_COMMAND:
+            code_writer.write_if(command.arg1)
+        elif opcode == FUNCTION_COMMAND:
+            zeroed = None
+            if code_writer.prologue is not None:
+                zeroed = locals_read_before_written(
+                    function_body(commands, cur_command), command.arg2)
+            code_writer.write_function(command.arg1, command.arg2, zeroed,
+                                       command.arg3)
+        elif opcode == CALL_COMMAND:
+            code_writer.write_call(command.arg1, command.arg2, command.arg3)
+        elif opcode == RETURN_COMMAND:
             code_writer.write_return()
-        parser.advance()
+        elif opcode == MOVE_COMMAND:
+            code_writer.write_move(command.arg1, command.arg2,
+                                   command.arg3, command.arg4)
+        elif opcode == INCREMENT_COMMAND:
+            code_writer.write_increment(command.arg1, command.arg2,
+                                        command.arg3)
+        elif opcode == TAIL_CALL_COMMAND:
+            code_writer.write_tail_call(command.arg1, command.arg2,
+                                        command.arg3, command.arg4)
+    code_writer.flush_stack()
+
+
+def translate_fragment(file_name: str, commands: typing.List[Command],
+                       writer_options: typing.Dict[str, typing.Any],
+                       fuse_branches: bool = False,
+                       optimize: bool = False) -> typing.Tuple[
+        str, typing.List[str]]:
+    """Translates the parsed commands of a single file (without the
+    bootstrap code) into a fragment of assembly. The translation only
+    depends on the arguments, so the files of a program can be translated
+    in any order, on any process.
+
+    Args:
+        file_name (str): the name of the file, without the .vm extension.
+        commands (typing.List[Command]): the commands to translate.
+        writer_options (typing.Dict[str, typing.Any]): keyword arguments for
+            the CodeWriter.
+        fuse_branches (bool): if this is True, "eq|gt|lt; [not]; if-goto"
+            is translated as a single compare-and-jump.
+        optimize (bool): run the optimization pass before translating.
+
+    Returns:
+        typing.Tuple[str, typing.List[str]]: the assembly of the file, and
+        the reports of the optimizer and of the prologues.
+    """
+    reports = []
+    if optimize:
+        optimizer = Optimizer()
+        commands = optimizer.optimize(commands)
+        reports.append(optimizer.report(f'{file_name}.vm'))
+    fragment = io.StringIO()
+    code_writer = CodeWriter(fragment, **writer_options)
+    code_writer.set_file_name(file_name)
+    translate_commands(commands, code_writer, False, fuse_branches)
+    if code_writer.prologue is not None:
+        reports.append(code_writer.prologue_report())
+    return fragment.getvalue(), reports
+
+
+def translate_files(files: typing.Dict[str, typing.List[Command]],
+                    writer_options: typing.Dict[str, typing.Any],
+                    fuse_branches: bool = False, optimize: bool = False,
+                    jobs: int = 1) -> typing.List[
+        typing.Tuple[str, typing.List[str]]]:
+    """Translates every file of a program into a fragment. With more than
+    one job, the files are spread over a pool of worker processes. The
+    fragments are the same whatever the number of jobs.
+
+    Args:
+        files (typing.Dict[str, typing.List[Command]]): the parsed commands
+            of every file, by file name.
+        writer_options (typing.Dict[str, typing.Any]): keyword arguments for
+            the CodeWriters.
+        fuse_branches (bool): see translate_fragment.
+        optimize (bool): run the optimization pass before translating.
+        jobs (int): number of worker processes to use.
+
+    Returns:
+        typing.List[typing.Tuple[str, typing.List[str]]]: the fragment and
+        the reports of every file, in the order of the files.
+    """
+    count = len(files)
+    if jobs <= 1 or count <= 1:
+        results = [translate_fragment(file_name, commands, writer_options,
+                                      fuse_branches, optimize)
+                   for file_name, commands in files.items()]
+    else:
+        chunk_size = max(1, count // (jobs * 4))
+        with concurrent.futures.ProcessPoolExecutor(jobs) as executor:
+            results = list(executor.map(
+                translate_fragment, files.keys(), files.values(),
+                [writer_options] * count, [fuse_branches] * count,
+                [optimize] * count, chunksize=chunk_size))
+    return results
+
+
+def whole_program_passes(files: typing.Dict[str, typing.List[Command]],
+                         drop_unused: bool = False,
+                         tail_calls: bool = False,
+                         pointer_saves: bool = False) -> typing.Tuple[
+        typing.Dict[str, typing.List[Command]], typing.List[str]]:
+    """Runs the passes that need the commands of every file at once.
+
+    Args:
+        files (typing.Dict[str, typing.List[Command]]): the parsed commands
+            of every file, by file name.
+        drop_unused (bool): drop the functions Sys.init can not reach.
+        tail_calls (bool): mark the calls that can reuse the caller's frame.
+        pointer_saves (bool): mark the functions whose frames can skip
+            saving THIS or THAT, and the calls of them.
+
+    Returns:
+        typing.Tuple[typing.Dict[str, typing.List[Command]],
+        typing.List[str]]: the commands of every file after the passes, and
+        their reports.
+    """
+    reports = []
+    if drop_unused:
+        files, dropped = CallGraph(files).drop_unreachable()
+        reports.append("\n".join(
+            [f'{len(dropped)} unreachable functions dropped']
+            + [f'    {function_name}' for function_name in dropped]))
+    if tail_calls:
+        files, count = CallGraph(files).mark_tail_calls()
+        reports.append(f'{count} tail calls')
+    if pointer_saves:
+        # after tail calls, which link the frames of the functions
+        saved = plan_pointer_saves(files)
+        files = mark_pointer_saves(files, saved)
+        reports.append(pointer_saves_report(files, saved))
+    return files, reports
+
+
+def link(fragments: typing.List[str],
+         writer_options: typing.Dict[str, typing.Any],
+         frames: typing.Iterable[int] = (SAVE_BOTH,)) -> HackEncoder:
+    """
+    Args:
+        fragments (typing.List[str]): the fragments of every file.
+        writer_options (typing.Dict[str, typing.Any]): keyword arguments for
+            the CodeWriter of the bootstrap code.
+        frames (typing.Iterable[int]): the kinds of frames that the functions
+            use, as given by frames_used.
+
+    Returns:
+        HackEncoder: the machine code of the bootstrap code, followed by the
+        fragments.
+    """
+    encoder = HackEncoder()
+    if fragments:
+        CodeWriter(encoder, **writer_options).write_init(frames)
+    for fragment in fragments:
+        encoder.write(fragment)
+    return encoder
+
+
+def count_instructions(commands: typing.List[Command],
+                       writer_options: typing.Dict[str, typing.Any]) -> int:
+    """
+    Args:
+        commands (typing.List[Command]): straight-line commands.
+        writer_options (typing.Dict[str, typing.Any]): keyword arguments for
+            the CodeWriter.
+
+    Returns:
+        int: the number of instructions the commands are translated into.
+    """
+    encoder = HackEncoder()
+    translate_commands(commands, CodeWriter(encoder, **writer_options), False)
+    return len(encoder.finish())
+
+
+def inlining_report(inliner: Inliner,
+                    writer_options: typing.Dict[str, typing.Any],
+                    rom_words: typing.Optional[typing.Tuple[int, int]] = None
+                    ) -> str:
+    """
+    Args:
+        inliner (Inliner): the inliner that ran on the program.
+        writer_options (typing.Dict[str, typing.Any]): keyword arguments for
+            the CodeWriters.
+        rom_words (typing.Optional[typing.Tuple[int, int]]): the ROM words of
+            the program without and with inlining, if they were measured.
+
+    Returns:
+        str: the change in ROM words (if given), and the instructions that
+        every call of an inlined function no longer executes: the call, the
+        prologue and the return, less the commands before the inlined body.
+    """
+    lines = ["inlining:"]
+    if rom_words is not None:
+        baseline_size, size = rom_words
+        lines[0] += (f' {baseline_size} -> {size} ROM words '
+                     f'({size - baseline_size:+})')
+    routines = 0
+    if writer_options["shared_calls"]:
+        encoder = HackEncoder()
+        code_writer = CodeWriter(encoder, **writer_options)
+        code_writer.write_call_routine()
+        code_writer.write_return_routine()
+        routines = len(encoder.finish())
+    for function_name in sorted(inliner.glue):
+        n_args, glue = inliner.glue[function_name]
+        file_name, n_vars, body = inliner.functions[function_name]
+        protocol = routines + count_instructions(
+            [Command(CALL_COMMAND, function_name, n_args),
+             Command(FUNCTION_COMMAND, function_name, n_vars),
+             Command(RETURN_COMMAND)], writer_options)
+        saved = protocol - count_instructions(glue, writer_options)
+        lines.append(f'    {function_name}: about {-saved:+} executed '
+                     f'instructions per call')
+    return "\n".join(lines)
 
 
 if "__main__" == __name__:
-    # Parses the input path and calls translate_file on each input file.
-    # This opens both the input and the output files!
+    # Parses the input path and every input file, and translates each of
+    # them. This opens both the input and the output files!
     # Both are closed automatically when the code finishes running.
     # If the output file does not exist, it is created automatically in the
     # correct path, using the correct filename.
-    if not len(sys.argv) == 2:
-        sys.exit("Invalid usage, please use: VMtranslator <input path>")
-    argument_path = os.path.abspath(sys.argv[1])
+    arg_parser = argparse.ArgumentParser(prog="VMtranslator")
+    arg_parser.add_argument(
+        "input_path", help="a .vm file or a directory of .vm files")
+    arg_parser.add_argument(
+        "--shared-calls", action="store_true",
+        help="jump to one shared call routine and one shared return routine "
+             "instead of inlining them, for much smaller programs")
+    arg_parser.add_argument(
+        "--shared-comparisons", action="store_true",
+        help="jump to shared eq, gt and lt routines instead of inlining "
+             "them at every use")
+    arg_parser.add_argument(
+        "--fuse-branches", action="store_true",
+        help='translate "eq|gt|lt; [not]; if-goto" as a single '
+             "compare-and-jump")
+    arg_parser.add_argument(
+        "--optimize", action="store_true",
+        help="fold constants and fuse stack traffic before translating, and "
+             "report the VM commands saved")
+    arg_parser.add_argument(
+        "--drop-unused", action="store_true",
+        help="translate only the functions that Sys.init can reach through "
+             "calls, and report the dropped ones")
+    arg_parser.add_argument(
+        "--inline", type=int, metavar="SIZE",
+        help="copy the functions of at most SIZE VM commands into their "
+             "callers instead of calling them, and report the decisions and "
+             "the executed instructions it saves per call")
+    arg_parser.add_argument(
+        "--inline-report", action="store_true",
+        help="with --inline, also translate the program without inlining, "
+             "to report the change in ROM words")
+    arg_parser.add_argument(
+        "--tail-calls", action="store_true",
+        help='translate "call f n; return" as a jump that reuses the frame '
+             "of the caller, where the number of arguments allows it")
+    arg_parser.add_argument(
+        "--pointer-saves", action="store_true",
+        help="let calls save and restore only the pointers (THIS and THAT) "
+             "that the called function sets, and report the savings")
+    arg_parser.add_argument(
+        "--cache-top", action="store_true",
+        help="keep the top of the stack in the D register between "
+             "consecutive stack operations")
+    arg_parser.add_argument(
+        "--virtual-stack", action="store_true",
+        help="track the stack pointer statically between consecutive stack "
+             "operations, and write it back only where control can merge")
+    arg_parser.add_argument(
+        "--prologue", choices=[SIZE_GOAL, SPEED_GOAL],
+        help="zero only the locals that may be read before they are written, "
+             "with a loop or unrolled code, whichever is smaller or faster; "
+             "and report the prologue of every function")
+    arg_parser.add_argument(
+        "--ram-report", action="store_true",
+        help="report the RAM words of the temp segment, the translator's "
+             "scratch registers and the statics of every file")
+    arg_parser.add_argument(
+        "--jobs", type=int, default=1, metavar="N",
+        help="translate the files on N processes (0 uses every CPU)")
+    arg_parser.add_argument(
+        "--no-cache", action="store_true",
+        help="translate every file, even if it did not change since the "
+             "last build")
+    arg_parser.add_argument(
+        "--hack", action="store_true",
+        help="write the machine code (.hack) directly, instead of assembly "
+             "for the assembler")
+    arg_parser.add_argument(
+        "--binary", action="store_true",
+        help="with --hack, write packed 16-bit words instead of lines of "
+             "'0'/'1' characters")
+    args = arg_parser.parse_args()
+    if args.binary and not args.hack:
+        arg_parser.error("--binary can only be combined with --hack")
+    if args.inline_report and args.inline is None:
+        arg_parser.error("--inline-report can only be combined with --inline")
+    argument_path = os.path.abspath(args.input_path)
     if os.path.isdir(argument_path):
+        directory = argument_path
         files_to_translate = [
             os.path.join(argument_path, filename)
-            for filename in os.listdir(argument_path)]
+            for filename in sorted(os.listdir(argument_path))]
         output_path = os.path.join(argument_path, os.path.basename(
             argument_path))
     else:
+        directory = os.path.dirname(argument_path)
         files_to_translate = [argument_path]
         output_path, extension = os.path.splitext(argument_path)
-    output_path += ".asm"
-    bootstrap = True
-    with open(output_path, 'w') as output_file:
-        for input_path in files_to_translate:
-            filename, extension = os.path.splitext(input_path)
-            if extension.lower() != ".vm":
-                continue
-            with open(input_path, 'r') as input_file:
-                translate_file(input_file, output_file, bootstrap)
-            bootstrap = False
+    output_path += ".hack" if args.hack else ".asm"
+    files = {}  # file name -> its parsed commands
+    for input_path in files_to_translate:
+        filename, extension = os.path.splitext(input_path)
+        if extension.lower() != ".vm":
+            continue
+        with open(input_path, 'r') as input_file:
+            files[os.path.basename(filename)] = \
+                Parser(input_file).get_commands()
+
+    # Inlining comes first, so the functions that are no longer called can
+    # be dropped, and the calls it leaves can become tail calls.
+    inliner = None
+    baseline_files = files
+    if args.inline is not None:
+        inliner = Inliner(files, args.inline)
+        files = inliner.inline()
+        print(inliner.report(), file=sys.stderr)
+    files, reports = whole_program_passes(files, args.drop_unused,
+                                          args.tail_calls, args.pointer_saves)
+    for report in reports:
+        print(report, file=sys.stderr)
+    ram_layout = RamLayout(files)
+    if args.ram_report:
+        print(ram_layout.report(), file=sys.stderr)
+    elif ram_layout.overflow():
+        print(f'warning: {ram_layout.overflow()} statics overlap the stack',
+              file=sys.stderr)
+
+    # The bootstrap code comes first, and then the fragments of the files,
+    # in the order of the directory listing.
+    writer_options = {"shared_calls": args.shared_calls,
+                      "shared_comparisons": args.shared_comparisons,
+                      "cache_top": args.cache_top,
+                      "virtual_stack": args.virtual_stack,
+                      "prologue": args.prologue}
+
+    # Files whose commands (and the translator version and options) did not
+    # change since the last build reuse the fragment that build cached, and
+    # only the other files are translated.
+    cache = None
+    keys = {}
+    results = {}  # file name -> its fragment and reports
+    changed_files = files
+    if not args.no_cache:
+        cache = FragmentCache(directory, TRANSLATOR_VERSION)
+        options = " ".join(
+            [f'{name}={value}' for name, value in
+             sorted(writer_options.items())]
+            + [f'fuse_branches={args.fuse_branches}',
+               f'optimize={args.optimize}'])
+        changed_files = {}
+        for file_name, commands in files.items():
+            keys[file_name] = cache.key(commands, options)
+            cached = cache.load(file_name, keys[file_name])
+            if cached is None:
+                changed_files[file_name] = commands
+            else:
+                results[file_name] = cached
+
+    jobs = args.jobs if args.jobs > 0 else os.cpu_count()
+    results.update(zip(changed_files.keys(), translate_files(
+        changed_files, writer_options, args.fuse_branches, args.optimize,
+        jobs)))
+    if cache is not None:
+        for file_name in changed_files:
+            fragment, reports = results[file_name]
+            cache.record(file_name, keys[file_name], fragment, reports)
+        if directory == argument_path:
+            cache.prune(files.keys())
+        cache.save()
+    fragments = [results[file_name][0] for file_name in files]
+    for file_name in files:
+        for report in results[file_name][1]:
+            print(report, file=sys.stderr)
+    if inliner is not None:
+        rom_words = None
+        if args.inline_report:
+            # the program without inlining is translated only to compare
+            # sizes, and bypasses the cache, which holds the inlined
+            # fragments
+            baseline_files, reports = whole_program_passes(
+                baseline_files, args.drop_unused, args.tail_calls,
+                args.pointer_saves)
+            baseline_fragments = [
+                fragment for fragment, reports in translate_files(
+                    baseline_files, writer_options, args.fuse_branches,
+                    args.optimize, jobs)]
+            rom_words = (
+                len(link(baseline_fragments, writer_options,
+                         frames_used(baseline_files)).finish()),
+                len(link(fragments, writer_options,
+                         frames_used(files)).finish()))
+        print(inlining_report(inliner, writer_options, rom_words),
+              file=sys.stderr)
+    if args.hack:
+        with open(output_path, 'wb' if args.binary else 'w') as output_file:
+            link(fragments, writer_options, frames_used(files)).save(
+                output_file, args.binary)
+    else:
+        with open(output_path, 'w') as output_file:
+            if fragments:
+                CodeWriter(output_file, **writer_options).write_init(
+                    frames_used(files))
+            for fragment in fragments:
+                output_file.write(fragment)
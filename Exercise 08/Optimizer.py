@@ -0,0 +1,168 @@
+"""
+This file is part of nand2tetris, as taught in The Hebrew University, and
+was written by Aviv Yaish. It is an extension to the specifications given
+[here](https://www.nand2tetris.org) (Shimon Schocken and Noam Nisan, 2017),
+as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0
+Unported [License](https://creativecommons.org/licenses/by-nc-sa/3.0/).
+"""
+import typing
+from Parser import Command, ADD_COMMAND, SUB_COMMAND, NEG_COMMAND, \
+    EQ_COMMAND, GT_COMMAND, LT_COMMAND, AND_COMMAND, OR_COMMAND, \
+    NOT_COMMAND, PUSH_COMMAND, POP_COMMAND, MOVE_COMMAND, \
+    INCREMENT_COMMAND, CONSTANT_SEGMENT
+
+CONSTANT_FOLDING = "constant expression folded"
+MOVE_FUSION = "push / pop fused into a move"
+INCREMENT_FUSION = "push / push constant / add|sub / pop fused into an inc"
+
+""" the values of constant expressions, as 16-bit words: """
+BINARY_OPERATIONS = {
+    ADD_COMMAND: lambda x, y: x + y,
+    SUB_COMMAND: lambda x, y: x - y,
+    AND_COMMAND: lambda x, y: x & y,
+    OR_COMMAND: lambda x, y: x | y,
+    EQ_COMMAND: lambda x, y: -1 if x == y else 0,
+    GT_COMMAND: lambda x, y: -1 if x > y else 0,
+    LT_COMMAND: lambda x, y: -1 if x < y else 0,
+}
+UNARY_OPERATIONS = {
+    NEG_COMMAND: lambda x: -x,
+    NOT_COMMAND: lambda x: ~x,
+}
+
+
+def to_word(value: int) -> int:
+    """
+    Args:
+        value (int): an integer.
+
+    Returns:
+        int: the value of the integer as a signed 16-bit word.
+    """
+    return (value + 0x8000) % 0x10000 - 0x8000
+
+
+class Optimizer:
+    """
+    An optimization pass over the commands of a .vm file, which runs before
+    the CodeWriter. It folds constants and fuses stack traffic:
+    - push constant a; push constant b; <binary op> -> push constant c
+    - push constant a; neg|not -> push constant c
+    - push S i; push constant c; add|sub; pop S i -> inc S i (+-c)
+    - push S i; pop T j -> move S i T j
+    Constants are signed 16-bit words, so they may become negative.
+    "move" and "inc" are extended commands that only this translator knows.
+    Only consecutive commands are merged, so a label is always a barrier.
+    """
+
+    def __init__(self) -> None:
+        """Creates an optimizer with zeroed statistics."""
+        self.hits = {CONSTANT_FOLDING: 0, MOVE_FUSION: 0,
+                     INCREMENT_FUSION: 0}
+        self.commands_before = 0
+        self.commands_after = 0
+
+    def optimize(self, commands: typing.List[Command]) -> typing.List[
+            Command]:
+        """Optimizes the commands of a .vm file. Every command is pushed on
+        an output list, and the patterns are matched against the end of the
+        list, so the result of one pattern can feed the next one.
+
+        Args:
+            commands (typing.List[Command]): the parsed commands of a .vm
+                file.
+
+        Returns:
+            typing.List[Command]: the optimized commands.
+        """
+        optimized = []
+        for command in commands:
+            optimized.append(command)
+            while self.reduce(optimized):
+                pass
+        self.commands_before += len(commands)
+        self.commands_after += len(optimized)
+        return optimized
+
+    def reduce(self, commands: typing.List[Command]) -> bool:
+        """Replaces the commands at the end of the list, if they match one of
+        the patterns.
+
+        Args:
+            commands (typing.List[Command]): the commands optimized so far.
+
+        Returns:
+            bool: True if a pattern matched.
+        """
+        last = commands[-1]
+        if len(commands) >= 3 and last.opcode in BINARY_OPERATIONS \
+                and self.is_constant(commands[-3]) \
+                and self.is_constant(commands[-2]):
+            value = BINARY_OPERATIONS[last.opcode](
+                commands[-3].arg2, commands[-2].arg2)
+            commands[-3:] = [Command(PUSH_COMMAND, CONSTANT_SEGMENT,
+                                     to_word(value))]
+            self.hits[CONSTANT_FOLDING] += 1
+            return True
+
+        if len(commands) >= 2 and last.opcode in UNARY_OPERATIONS \
+                and self.is_constant(commands[-2]):
+            value = UNARY_OPERATIONS[last.opcode](commands[-2].arg2)
+            commands[-2:] = [Command(PUSH_COMMAND, CONSTANT_SEGMENT,
+                                     to_word(value))]
+            self.hits[CONSTANT_FOLDING] += 1
+            return True
+
+        if len(commands) >= 4 and last.opcode == POP_COMMAND \
+                and commands[-4].opcode == PUSH_COMMAND \
+                and commands[-4].arg1 == last.arg1 \
+                and commands[-4].arg2 == last.arg2 \
+                and self.is_constant(commands[-3]) \
+                and commands[-2].opcode in (ADD_COMMAND, SUB_COMMAND):
+            delta = commands[-3].arg2
+            if commands[-2].opcode == SUB_COMMAND:
+                delta = -delta
+            commands[-4:] = [Command(INCREMENT_COMMAND, last.arg1, last.arg2,
+                                     to_word(delta))]
+            self.hits[INCREMENT_FUSION] += 1
+            return True
+
+        if len(commands) >= 2 and last.opcode == POP_COMMAND \
+                and commands[-2].opcode == PUSH_COMMAND:
+            commands[-2:] = [Command(MOVE_COMMAND, commands[-2].arg1,
+                                     commands[-2].arg2, last.arg1,
+                                     last.arg2)]
+            self.hits[MOVE_FUSION] += 1
+            return True
+        return False
+
+    @staticmethod
+    def is_constant(command: Command) -> bool:
+        """
+        Args:
+            command (Command): a parsed command.
+
+        Returns:
+            bool: True if the command is "push constant <value>".
+        """
+        return command.opcode == PUSH_COMMAND \
+            and command.arg1 == CONSTANT_SEGMENT
+
+    def report(self, name: str) -> str:
+        """
+        Args:
+            name (str): the name of the optimized file.
+
+        Returns:
+            str: a summary of the commands saved by each pattern.
+        """
+        saved = self.commands_before - self.commands_after
+        percent = 100 * saved / self.commands_before \
+            if self.commands_before else 0
+        lines = [f'{name}: {self.commands_before} -> '
+                 f'{self.commands_after} VM commands '
+                 f'({saved} saved, {percent:.1f}%)']
+        for pattern, hits in self.hits.items():
+            if hits:
+                lines.append(f'    {hits:7} x {pattern}')
+        return "\n".join(lines)
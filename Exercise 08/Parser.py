@@ -7,43 +7,156 @@ Unported [License](https://creativecommons.org/licenses/by-nc-sa/3.0/).
 """
 import typing
 
-C_ARITHMETIC_COMMAND = "C_ARITHMETIC"
-C_PUSH_COMMAND = "C_PUSH"
-C_POP_COMMAND = "C_POP"
-C_LABEL_COMMAND = "C_LABEL"
-C_IF_COMMAND = "C_IF"
-C_GOTO_COMMAND = "C_GOTO"
-C_CALL_COMMAND = "C_CALL"
-C_FUNCTION_COMMAND = "C_FUNCTION"
-C_RETURN_COMMAND = "C_RETURN"
-
-PUSH_COMMAND = "push"
-POP_COMMAND = "pop"
-LABEL_COMMAND = "label"
-IF_COMMAND = "if-goto"
-GOTO_COMMAND = "goto"
-CALL_COMMAND = "call"
-FUNCTION_COMMAND = "function"
-RETURN_COMMAND = "return"
-ADD_COMMAND = "add"
-SUB_COMMAND = "sub"
-AND_COMMAND = "and"
-OR_COMMAND = "or"
-SHIFT_LEFT_COMMAND = "shiftleft"
-SHIFT_RIGHT_COMMAND = "shiftright"
-NEG_COMMAND = "neg"
-EQ_COMMAND = "eq"
-GT_COMMAND = "gt"
-LT_COMMAND = "lt"
-NOT_COMMAND = "not"
-CONSTANT_SEGMENT = "constant"
-STATIC_SEGMENT = "static"
-POINTER_SEGMENT = "pointer"
-TEMP_SEGMENT = "temp"
-LOCAL_SEGMENT = "local"
-ARGUMENT_SEGMENT = "argument"
-THIS_SEGMENT = "this"
-THAT_SEGMENT = "that"
+""" opcodes of the VM commands: """
+ADD_COMMAND = 0
+SUB_COMMAND = 1
+NEG_COMMAND = 2
+EQ_COMMAND = 3
+GT_COMMAND = 4
+LT_COMMAND = 5
+AND_COMMAND = 6
+OR_COMMAND = 7
+NOT_COMMAND = 8
+SHIFT_LEFT_COMMAND = 9
+SHIFT_RIGHT_COMMAND = 10
+PUSH_COMMAND = 11
+POP_COMMAND = 12
+LABEL_COMMAND = 13
+IF_COMMAND = 14
+GOTO_COMMAND = 15
+CALL_COMMAND = 16
+FUNCTION_COMMAND = 17
+RETURN_COMMAND = 18
+MOVE_COMMAND = 19
+INCREMENT_COMMAND = 20
+TAIL_CALL_COMMAND = 21
+
+""" the arithmetic commands are the opcodes up to this one: """
+LAST_ARITHMETIC_COMMAND = SHIFT_RIGHT_COMMAND
+
+""" segment codes: """
+CONSTANT_SEGMENT = 0
+STATIC_SEGMENT = 1
+POINTER_SEGMENT = 2
+TEMP_SEGMENT = 3
+LOCAL_SEGMENT = 4
+ARGUMENT_SEGMENT = 5
+THIS_SEGMENT = 6
+THAT_SEGMENT = 7
+
+COMMANDS = {"add": ADD_COMMAND, "sub": SUB_COMMAND, "neg": NEG_COMMAND,
+            "eq": EQ_COMMAND, "gt": GT_COMMAND, "lt": LT_COMMAND,
+            "and": AND_COMMAND, "or": OR_COMMAND, "not": NOT_COMMAND,
+            "shiftleft": SHIFT_LEFT_COMMAND,
+            "shiftright": SHIFT_RIGHT_COMMAND,
+            "push": PUSH_COMMAND, "pop": POP_COMMAND,
+            "label": LABEL_COMMAND, "if-goto": IF_COMMAND,
+            "goto": GOTO_COMMAND, "call": CALL_COMMAND,
+            "function": FUNCTION_COMMAND, "return": RETURN_COMMAND,
+            "move": MOVE_COMMAND, "inc": INCREMENT_COMMAND,
+            "tail-call": TAIL_CALL_COMMAND}
+SEGMENTS = {"constant": CONSTANT_SEGMENT, "static": STATIC_SEGMENT,
+            "pointer": POINTER_SEGMENT, "temp": TEMP_SEGMENT,
+            "local": LOCAL_SEGMENT, "argument": ARGUMENT_SEGMENT,
+            "this": THIS_SEGMENT, "that": THAT_SEGMENT}
+COMMAND_NAMES = {opcode: name for name, opcode in COMMANDS.items()}
+SEGMENT_NAMES = {segment: name for name, segment in SEGMENTS.items()}
+
+
+class Command:
+    """A single VM command, parsed once into an opcode and its arguments:
+    - push/pop: arg1 is the segment code and arg2 the index.
+    - label/goto/if-goto: arg1 is the label.
+    - function/call: arg1 is the function name and arg2 the number of
+      local variables/arguments. arg3 is set if the frame of the function
+      saves only some of THIS and THAT (a mask of PointerSaves).
+    - move: arg1, arg2 are the source segment and index, and arg3, arg4
+      the destination segment and index.
+    - inc: arg1, arg2 are the segment and index, and arg3 the value to add.
+    - tail-call: arg1 is the function name, arg2 the number of arguments,
+      and arg3 the number of arguments of the calling function. arg4 is
+      the mask of saved pointers, as for call.
+    Unused arguments are None.
+    """
+
+    __slots__ = ("opcode", "arg1", "arg2", "arg3", "arg4")
+
+    def __init__(self, opcode: int, arg1: typing.Any = None,
+                 arg2: typing.Optional[int] = None,
+                 arg3: typing.Optional[int] = None,
+                 arg4: typing.Optional[int] = None) -> None:
+        """Creates a command record.
+
+        Args:
+            opcode (int): the opcode of the command.
+            arg1 (typing.Any): the first argument (a segment code or a name).
+            arg2 (typing.Optional[int]): the second argument.
+            arg3 (typing.Optional[int]): the third argument.
+            arg4 (typing.Optional[int]): the fourth argument.
+        """
+        self.opcode = opcode
+        self.arg1 = arg1
+        self.arg2 = arg2
+        self.arg3 = arg3
+        self.arg4 = arg4
+
+    def __str__(self) -> str:
+        """
+        Returns:
+            str: the command in the VM language.
+        """
+        words = [COMMAND_NAMES[self.opcode]]
+        if self.opcode == PUSH_COMMAND or self.opcode == POP_COMMAND \
+                or self.opcode == MOVE_COMMAND \
+                or self.opcode == INCREMENT_COMMAND:
+            words += [SEGMENT_NAMES[self.arg1], str(self.arg2)]
+        elif self.arg1 is not None:
+            words.append(self.arg1)
+            if self.arg2 is not None:
+                words.append(str(self.arg2))
+        if self.opcode == MOVE_COMMAND:
+            words += [SEGMENT_NAMES[self.arg3], str(self.arg4)]
+        elif self.opcode == INCREMENT_COMMAND \
+                or self.opcode == TAIL_CALL_COMMAND:
+            words.append(str(self.arg3))
+            if self.arg4 is not None:
+                words.append(str(self.arg4))
+        elif self.arg3 is not None:
+            words.append(str(self.arg3))
+        return " ".join(words)
+
+
+def parse_command(line: str) -> Command:
+    """Parses a single VM command.
+
+    Args:
+        line (str): a command, without comments.
+
+    Returns:
+        Command: the parsed command.
+    """
+    words = line.split()
+    opcode = COMMANDS[words[0]]
+    if opcode <= LAST_ARITHMETIC_COMMAND or opcode == RETURN_COMMAND:
+        return Command(opcode)
+    if opcode == PUSH_COMMAND or opcode == POP_COMMAND:
+        return Command(opcode, SEGMENTS[words[1]], int(words[2]))
+    if opcode == FUNCTION_COMMAND or opcode == CALL_COMMAND:
+        if len(words) > 3:
+            return Command(opcode, words[1], int(words[2]), int(words[3]))
+        return Command(opcode, words[1], int(words[2]))
+    if opcode == MOVE_COMMAND:
+        return Command(opcode, SEGMENTS[words[1]], int(words[2]),
+                       SEGMENTS[words[3]], int(words[4]))
+    if opcode == INCREMENT_COMMAND:
+        return Command(opcode, SEGMENTS[words[1]], int(words[2]),
+                       int(words[3]))
+    if opcode == TAIL_CALL_COMMAND:
+        if len(words) > 4:
+            return Command(opcode, words[1], int(words[2]), int(words[3]),
+                           int(words[4]))
+        return Command(opcode, words[1], int(words[2]), int(words[3]))
+    return Command(opcode, words[1])
 
 
 class Parser:
@@ -82,29 +195,55 @@ class Parser:
       - call <function-name> <n-args>
       - function <function-name> <n-vars>
       - return
+    - Extended commands, written only by the translator's own passes:
+      - move <segment> <number> <segment that is not constant> <number>
+      - inc <segment that is not constant> <number> <value>
+      - tail-call <function-name> <n-args> <n-args of the caller>
+      - call, function and tail-call may end with the mask of the pointers
+        that the frame of the function saves, if it is not both of them
     """
 
     def __init__(self, input_file: typing.TextIO) -> None:
-        """Gets ready to parse the input file.
+        """Gets ready to parse the input file. Every command is parsed once,
+        into the list of Command records in self.commands. Commands with the
+        same text share one record.
 
         Args:
             input_file (typing.TextIO): input file.
         """
-        self.input_lines_init = input_file.read().splitlines()
-        self.input_lines = []
-        for line in self.input_lines_init:
-            if line.isspace() or not line:
-                continue
-            if line.startswith("/"):
-                continue
+        self.commands = []
+        parsed = {}  # command text -> its shared Command record
+        for line in input_file.read().splitlines():
             if '/' in line:
-                slashInd = line.find('/')
-                line = line[:slashInd]
-                self.input_lines.append(line)
+                line = line[:line.find('/')]
+            line = " ".join(line.split())
+            if not line:
                 continue
-            self.input_lines.append(line)
+            command = parsed.get(line)
+            if command is None:
+                command = parse_command(line)
+                parsed[line] = command
+            self.commands.append(command)
+
+        self.num_lines = len(self.commands)
+        self.cur_line = 0
+
+    def get_commands(self) -> typing.List[Command]:
+        """
+        Returns:
+            typing.List[Command]: all the commands of the file.
+        """
+        return self.commands
 
-        self.num_lines = len(self.input_lines)
+    def set_commands(self, commands: typing.List[Command]) -> None:
+        """Replaces the commands of the file, e.g. with optimized commands,
+        and restarts the parsing from the first one.
+
+        Args:
+            commands (typing.List[Command]): the new commands.
+        """
+        self.commands = commands
+        self.num_lines = len(self.commands)
         self.cur_line = 0
 
     def has_more_commands(self) -> bool:
@@ -113,9 +252,7 @@ class Parser:
         Returns:
             bool: True if there are more commands, False otherwise.
         """
-        if self.cur_line >= self.num_lines:
-            return False
-        return True
+        return self.cur_line < self.num_lines
 
     def advance(self) -> None:
         """Reads the next command from the input and makes it the current 
@@ -124,74 +261,33 @@ class Parser:
         """
         self.cur_line = self.cur_line + 1
 
-    def get_cur_command(self) -> str:
-        """This function returns the current VM command (one of:add, sub,
-        neg, eq, gt, lt, and, or, not, shiftleft, shiftright, push, pop, label,
-        if-goto, goto, call, function, return).
+    def get_cur_command(self) -> Command:
+        """
+        Returns:
+            Command: the current command.
         """
-        return self.input_lines[self.cur_line].split()[0]
+        return self.commands[self.cur_line]
 
-    def command_type(self) -> str:
+    def command_type(self) -> int:
         """
         Returns:
-            str: the type of the current VM command.
-            "C_ARITHMETIC" is returned for all arithmetic commands.
-            For other commands, can return:
-            "C_PUSH", "C_POP", "C_LABEL", "C_GOTO", "C_IF", "C_FUNCTION",
-            "C_RETURN", "C_CALL".
-        """
-        commands_dict = {ADD_COMMAND: C_ARITHMETIC_COMMAND,
-                         SUB_COMMAND: C_ARITHMETIC_COMMAND,
-                         NEG_COMMAND: C_ARITHMETIC_COMMAND,
-                         EQ_COMMAND: C_ARITHMETIC_COMMAND,
-                         GT_COMMAND: C_ARITHMETIC_COMMAND,
-                         LT_COMMAND: C_ARITHMETIC_COMMAND,
-                         AND_COMMAND: C_ARITHMETIC_COMMAND,
-                         OR_COMMAND: C_ARITHMETIC_COMMAND,
-                         NOT_COMMAND: C_ARITHMETIC_COMMAND,
-                         SHIFT_LEFT_COMMAND: C_ARITHMETIC_COMMAND,
-                         SHIFT_RIGHT_COMMAND: C_ARITHMETIC_COMMAND,
-                         PUSH_COMMAND: C_PUSH_COMMAND,
-                         POP_COMMAND: C_POP_COMMAND,
-                         LABEL_COMMAND: C_LABEL_COMMAND,
-                         IF_COMMAND: C_IF_COMMAND,
-                         GOTO_COMMAND: C_GOTO_COMMAND,
-                         CALL_COMMAND: C_CALL_COMMAND,
-                         FUNCTION_COMMAND: C_FUNCTION_COMMAND,
-                         RETURN_COMMAND: C_RETURN_COMMAND}
-
-        return commands_dict[self.input_lines[self.cur_line].split()[0]]
-
-    def arg1(self) -> str:
+            int: the opcode of the current VM command.
+        """
+        return self.commands[self.cur_line].opcode
+
+    def arg1(self) -> typing.Any:
         """
         Returns:
-            str: the first argument of the current command. In case of 
-            "C_ARITHMETIC", the command itself (add, sub, etc.) is returned. 
-            Should not be called if the current command is "C_RETURN".
-        """
-        if self.command_type() == C_ARITHMETIC_COMMAND:
-            return self.input_lines[self.cur_line]
-        if self.command_type() == C_PUSH_COMMAND \
-                or self.command_type() == C_POP_COMMAND \
-                or self.command_type() == C_LABEL_COMMAND \
-                or self.command_type() == C_IF_COMMAND \
-                or self.command_type() == C_GOTO_COMMAND \
-                or self.command_type() == C_CALL_COMMAND \
-                or self.command_type() == C_FUNCTION_COMMAND:
-            return self.input_lines[self.cur_line].split()[1]
-        return ""
+            typing.Any: the first argument of the current command: a segment
+            code for push and pop, and a name for the other commands.
+        """
+        return self.commands[self.cur_line].arg1
 
     def arg2(self) -> int:
         """
         Returns:
             int: the second argument of the current command. Should be
-            called only if the current command is "C_PUSH", "C_POP", 
-            "C_FUNCTION" or "C_CALL".
+            called only if the current command is push, pop, function or
+            call.
         """
-        if self.command_type() == C_PUSH_COMMAND \
-                or self.command_type() == C_POP_COMMAND \
-                or self.command_type() == C_CALL_COMMAND \
-                or self.command_type() == C_FUNCTION_COMMAND:
-            return int(self.input_lines[self.cur_line].split()[2])
-
-        return 0
+        return self.commands[self.cur_line].arg2
@@ -0,0 +1,187 @@
+"""
+This file is part of nand2tetris, as taught in The Hebrew University, and
+was written by Aviv Yaish. It is an extension to the specifications given
+[here](https://www.nand2tetris.org) (Shimon Schocken and Noam Nisan, 2017),
+as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0
+Unported [License](https://creativecommons.org/licenses/by-nc-sa/3.0/).
+"""
+import typing
+from Parser import Command, CALL_COMMAND, FUNCTION_COMMAND, \
+    TAIL_CALL_COMMAND
+from Inliner import written_pointers as pointer_indices
+
+""" the pointers that the frame of a function saves, as bit masks: """
+SAVE_NONE = 0
+SAVE_THIS = 1
+SAVE_THAT = 2
+SAVE_BOTH = SAVE_THIS | SAVE_THAT
+SAVE_NAMES = {SAVE_NONE: "NONE", SAVE_THIS: "THIS", SAVE_THAT: "THAT",
+              SAVE_BOTH: "BOTH"}
+
+""" the function that the bootstrap code calls with a full frame: """
+ENTRY_FUNCTION = "Sys.init"
+
+
+def frame_size(saved: int) -> int:
+    """
+    Args:
+        saved (int): the pointers that a frame saves.
+
+    Returns:
+        int: the number of words of the frame: the return address, LCL,
+        ARG, and the saved pointers.
+    """
+    return 3 + (saved & SAVE_THIS) + (saved & SAVE_THAT) // SAVE_THAT
+
+
+def written_pointers(body: typing.List[Command]) -> int:
+    """
+    Args:
+        body (typing.List[Command]): the commands of a function.
+
+    Returns:
+        int: the pointers that the commands of the function set.
+    """
+    saved = SAVE_NONE
+    for pointer in pointer_indices(body):
+        saved |= SAVE_THIS if pointer == 0 else SAVE_THAT
+    return saved
+
+
+def plan_pointer_saves(files: typing.Dict[str, typing.List[Command]],
+                       root: str = ENTRY_FUNCTION) -> typing.Dict[str, int]:
+    """Finds the pointers that the frame of every function has to save. A
+    call restores the pointers that the callee's frame saved, so a function
+    can only change THIS and THAT by setting them itself: the ones it sets
+    are the ones its frame must save. A tail call is the exception, since
+    the tail-called function returns through the frame of its caller. So
+    the functions linked by tail calls must share one frame layout, which
+    saves every pointer that any of them sets: this is the least fixpoint
+    of "saved(f) includes saved(g)" over tail calls in both directions.
+    The root, which the bootstrap code calls, and the functions that tail
+    call functions outside the program, keep a full frame.
+
+    Args:
+        files (typing.Dict[str, typing.List[Command]]): the commands of
+            every .vm file of the program, by file name.
+        root (str): the function where the program starts.
+
+    Returns:
+        typing.Dict[str, int]: the pointers that the frame of every function
+        of the program saves.
+    """
+    saved = {}
+    tail_calls = {}  # function name -> the functions it tail calls
+    for commands in files.values():
+        start = None
+        for position, command in enumerate(commands + [None]):
+            if command is None or command.opcode == FUNCTION_COMMAND:
+                if start is not None:
+                    body = commands[start:position]
+                    saved[function_name] = written_pointers(body)
+                    tail_calls[function_name] = {
+                        call.arg1 for call in body
+                        if call.opcode == TAIL_CALL_COMMAND}
+                if command is not None:
+                    function_name = command.arg1
+                    start = position + 1
+    if root in saved:
+        saved[root] = SAVE_BOTH
+    changed = True
+    while changed:
+        changed = False
+        for function_name, callees in tail_calls.items():
+            for callee in callees:
+                merged = saved[function_name] | saved.get(callee, SAVE_BOTH)
+                if merged != saved[function_name] \
+                        or callee in saved and merged != saved[callee]:
+                    saved[function_name] = merged
+                    if callee in saved:
+                        saved[callee] = merged
+                    changed = True
+    return saved
+
+
+def mark_pointer_saves(files: typing.Dict[str, typing.List[Command]],
+                       saved: typing.Dict[str, int]) -> typing.Dict[
+        str, typing.List[Command]]:
+    """Writes the planned frame of every function into its function command
+    and into every call of it: as the third argument of "function" and
+    "call", and the fourth of "tail-call". Full frames are left unmarked.
+
+    Args:
+        files (typing.Dict[str, typing.List[Command]]): the commands of
+            every .vm file of the program, by file name.
+        saved (typing.Dict[str, int]): the plan of plan_pointer_saves.
+
+    Returns:
+        typing.Dict[str, typing.List[Command]]: the marked commands of every
+        file.
+    """
+    marked_files = {}
+    for file_name, commands in files.items():
+        marked = []
+        for command in commands:
+            opcode = command.opcode
+            if opcode == FUNCTION_COMMAND or opcode == CALL_COMMAND \
+                    or opcode == TAIL_CALL_COMMAND:
+                frame = saved.get(command.arg1, SAVE_BOTH)
+                if frame != SAVE_BOTH and opcode == TAIL_CALL_COMMAND:
+                    command = Command(opcode, command.arg1, command.arg2,
+                                      command.arg3, frame)
+                elif frame != SAVE_BOTH:
+                    command = Command(opcode, command.arg1, command.arg2,
+                                      frame)
+            marked.append(command)
+        marked_files[file_name] = marked
+    return marked_files
+
+
+def frames_used(files: typing.Dict[str, typing.List[Command]]) -> \
+        typing.Set[int]:
+    """
+    Args:
+        files (typing.Dict[str, typing.List[Command]]): the (marked) commands
+            of every .vm file of the program, by file name.
+
+    Returns:
+        typing.Set[int]: the kinds of frames that the functions use, which
+        need their own shared call and return routines.
+    """
+    frames = {SAVE_BOTH}
+    for commands in files.values():
+        for command in commands:
+            if command.opcode == FUNCTION_COMMAND \
+                    and command.arg3 is not None:
+                frames.add(command.arg3)
+    return frames
+
+
+def pointer_saves_report(files: typing.Dict[str, typing.List[Command]],
+                         saved: typing.Dict[str, int]) -> str:
+    """
+    Args:
+        files (typing.Dict[str, typing.List[Command]]): the commands of
+            every .vm file of the program, by file name.
+        saved (typing.Dict[str, int]): the plan of plan_pointer_saves.
+
+    Returns:
+        str: how many functions save which pointers, and how many calls save
+        fewer pointers than before.
+    """
+    functions = {frame: 0 for frame in SAVE_NAMES}
+    for frame in saved.values():
+        functions[frame] += 1
+    calls = reduced = 0
+    for commands in files.values():
+        for command in commands:
+            if command.opcode == CALL_COMMAND \
+                    or command.opcode == TAIL_CALL_COMMAND:
+                calls += 1
+                if saved.get(command.arg1, SAVE_BOTH) != SAVE_BOTH:
+                    reduced += 1
+    lines = [f'pointer saves: {reduced} of {calls} calls save fewer than '
+             f'THIS and THAT']
+    for frame, name in SAVE_NAMES.items():
+        lines.append(f'    {functions[frame]:7} x functions save {name}')
+    return "\n".join(lines)
@@ -0,0 +1,148 @@
+"""
+This file is part of nand2tetris, as taught in The Hebrew University, and
+was written by Aviv Yaish. It is an extension to the specifications given
+[here](https://www.nand2tetris.org) (Shimon Schocken and Noam Nisan, 2017),
+as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0
+Unported [License](https://creativecommons.org/licenses/by-nc-sa/3.0/).
+"""
+import typing
+from Parser import Command, PUSH_COMMAND, POP_COMMAND, LABEL_COMMAND, \
+    IF_COMMAND, GOTO_COMMAND, FUNCTION_COMMAND, RETURN_COMMAND, \
+    MOVE_COMMAND, INCREMENT_COMMAND, TAIL_CALL_COMMAND, LOCAL_SEGMENT
+
+""" prologue strategies: """
+UNROLLED_PROLOGUE = "unrolled"
+LOOP_PROLOGUE = "loop"
+
+""" goals of the cost model: """
+SIZE_GOAL = "size"
+SPEED_GOAL = "speed"
+
+""" the cost of the original prologue, push constant 0 per local: """
+PUSH_ZERO_SIZE = 7
+
+
+def function_body(commands: typing.List[Command],
+                  start: int) -> typing.List[Command]:
+    """
+    Args:
+        commands (typing.List[Command]): the commands of a file.
+        start (int): the position of the first command after a function
+            command.
+
+    Returns:
+        typing.List[Command]: the commands of the function, up to the next
+        function command.
+    """
+    end = start
+    while end < len(commands) and commands[end].opcode != FUNCTION_COMMAND:
+        end += 1
+    return commands[start:end]
+
+
+def locals_read_before_written(body: typing.List[Command],
+                               n_vars: int) -> typing.Set[int]:
+    """Finds the locals that some path through the function reads before it
+    writes them, so they must start as 0. This is a forward "must be
+    written" dataflow analysis: the locals written on every path reaching a
+    label are the intersection of the ones written on the paths of its
+    jumps. It is repeated until the labels do not change.
+
+    Args:
+        body (typing.List[Command]): the commands of a function.
+        n_vars (int): the number of locals of the function.
+
+    Returns:
+        typing.Set[int]: the locals that must be zeroed by the prologue.
+    """
+    all_locals = set(range(n_vars))
+    at_label = {}  # label -> the locals written on every path to it so far
+    while True:
+        previous = dict(at_label)
+        needed = set()
+        written = set()
+        reachable = True
+        for command in body:
+            opcode = command.opcode
+            if opcode == LABEL_COMMAND:
+                incoming = at_label.get(command.arg1, all_locals)
+                written = written & incoming if reachable else set(incoming)
+                reachable = True
+                continue
+            if not reachable:
+                continue
+            reads = writes = None
+            if opcode == PUSH_COMMAND and command.arg1 == LOCAL_SEGMENT:
+                reads = command.arg2
+            elif opcode == POP_COMMAND and command.arg1 == LOCAL_SEGMENT:
+                writes = command.arg2
+            elif opcode == INCREMENT_COMMAND \
+                    and command.arg1 == LOCAL_SEGMENT:
+                reads = writes = command.arg2
+            elif opcode == MOVE_COMMAND:
+                if command.arg1 == LOCAL_SEGMENT:
+                    reads = command.arg2
+                if command.arg3 == LOCAL_SEGMENT:
+                    writes = command.arg4
+            if reads is not None and reads not in written:
+                needed.add(reads)
+            if writes is not None:
+                written.add(writes)
+            if opcode == GOTO_COMMAND or opcode == IF_COMMAND:
+                at_label[command.arg1] = \
+                    at_label.get(command.arg1, all_locals) & written
+            if opcode == GOTO_COMMAND or opcode == RETURN_COMMAND \
+                    or opcode == TAIL_CALL_COMMAND:
+                reachable = False
+        if at_label == previous:
+            return needed & all_locals
+
+
+def prologue_cost(strategy: str, n_vars: int,
+                  zeroed: typing.Set[int]) -> typing.Tuple[int, int]:
+    """
+    Args:
+        strategy (str): UNROLLED_PROLOGUE or LOOP_PROLOGUE.
+        n_vars (int): the number of locals of the function.
+        zeroed (typing.Set[int]): the locals that must be zeroed.
+
+    Returns:
+        typing.Tuple[int, int]: the ROM words the prologue takes, and the
+        instructions it executes.
+    """
+    if n_vars == 0:
+        return 0, 0
+    if strategy == LOOP_PROLOGUE:
+        # @n, D=A, then @SP, AM=M+1, A=A-1, M=0, @loop, D=D-1;JGT per local
+        return 8, 2 + 6 * n_vars
+    # @SP, A=M, then M=0 for every zeroed local and A=A+1 between them
+    size = 2 + len(zeroed) + max(zeroed) if zeroed else 0
+    # SP += n_vars: @SP and M=M+1 per local, @n, D=A, @SP, M=M+D, or
+    # D=A+1, @SP, M=D right after zeroing the last local
+    sp_size = min(1 + n_vars, 4)
+    if zeroed and max(zeroed) == n_vars - 1:
+        sp_size = min(sp_size, 3)
+    return size + sp_size, size + sp_size
+
+
+def choose_prologue(n_vars: int, zeroed: typing.Set[int],
+                    goal: str) -> typing.Tuple[str, int]:
+    """Picks the cheapest prologue strategy. A loop zeroes every local, and
+    the unrolled prologue only zeroes the locals that need it.
+
+    Args:
+        n_vars (int): the number of locals of the function.
+        zeroed (typing.Set[int]): the locals that must be zeroed.
+        goal (str): SIZE_GOAL minimizes ROM words first, and SPEED_GOAL
+            minimizes executed instructions first.
+
+    Returns:
+        typing.Tuple[str, int]: the strategy, and the ROM words it takes.
+    """
+    best = None
+    for strategy in (UNROLLED_PROLOGUE, LOOP_PROLOGUE):
+        size, time = prologue_cost(strategy, n_vars, zeroed)
+        cost = (size, time) if goal == SIZE_GOAL else (time, size)
+        if best is None or cost < best[0]:
+            best = (cost, strategy, size)
+    return best[1], best[2]
@@ -0,0 +1,107 @@
+"""
+This file is part of nand2tetris, as taught in The Hebrew University, and
+was written by Aviv Yaish. It is an extension to the specifications given
+[here](https://www.nand2tetris.org) (Shimon Schocken and Noam Nisan, 2017),
+as allowed by the Creative Common Attribution-NonCommercial-ShareAlike 3.0
+Unported [License](https://creativecommons.org/licenses/by-nc-sa/3.0/).
+"""
+import typing
+from Parser import Command, PUSH_COMMAND, POP_COMMAND, MOVE_COMMAND, \
+    INCREMENT_COMMAND, STATIC_SEGMENT, TEMP_SEGMENT
+
+""" the RAM areas of the VM: """
+TEMP_BASE = 5
+TEMP_SIZE = 8
+SCRATCH_REGISTERS = ("R13", "R14", "R15")
+STATIC_BASE = 16
+STACK_BASE = 256
+STATIC_AREA_SIZE = STACK_BASE - STATIC_BASE
+
+
+def segment_accesses(command: Command) -> typing.List[
+        typing.Tuple[int, int]]:
+    """
+    Args:
+        command (Command): a parsed command.
+
+    Returns:
+        typing.List[typing.Tuple[int, int]]: the segments and indices that
+        the command reads or writes, in the order they are translated.
+    """
+    opcode = command.opcode
+    if opcode == PUSH_COMMAND or opcode == POP_COMMAND \
+            or opcode == INCREMENT_COMMAND:
+        return [(command.arg1, command.arg2)]
+    if opcode == MOVE_COMMAND:
+        return [(command.arg1, command.arg2), (command.arg3, command.arg4)]
+    return []
+
+
+class RamLayout:
+    """
+    The RAM words that a whole program uses outside of the stack and the
+    heap: the temp segment, the scratch registers of the translator, and the
+    statics of every file. The translator keeps all of its own scratch
+    values in R13-R15, so the static area (16-255) only holds statics.
+    Statics are assembler variables ("Xxx.i"), which the assembler puts at
+    16, 17, ... in the order in which it first meets them. The files are
+    translated in order and every static keeps its place in the commands,
+    so that order is known here, and so is the address of every static.
+    """
+
+    def __init__(self, files: typing.Dict[str, typing.List[Command]]) -> None:
+        """Plans the layout of a program.
+
+        Args:
+            files (typing.Dict[str, typing.List[Command]]): the commands of
+                every .vm file of the program, by file name, in the order
+                they are translated.
+        """
+        # file name -> static index -> address
+        self.statics = {}
+        self.temps = set()
+        address = STATIC_BASE
+        for file_name, commands in files.items():
+            file_statics = self.statics.setdefault(file_name, {})
+            for command in commands:
+                for segment, index in segment_accesses(command):
+                    if segment == STATIC_SEGMENT \
+                            and index not in file_statics:
+                        file_statics[index] = address
+                        address += 1
+                    elif segment == TEMP_SEGMENT:
+                        self.temps.add(index)
+        self.static_words = address - STATIC_BASE
+
+    def overflow(self) -> int:
+        """
+        Returns:
+            int: the number of statics that do not fit below the stack, and
+            would be overwritten by it.
+        """
+        return max(0, self.static_words - STATIC_AREA_SIZE)
+
+    def report(self) -> str:
+        """
+        Returns:
+            str: the RAM words of every area, and the addresses of the
+            statics of every file.
+        """
+        lines = [f'RAM: {self.static_words} of {STATIC_AREA_SIZE} static '
+                 f'words used']
+        lines.append(f'    {0:5}-{TEMP_BASE - 1:<5} SP, LCL, ARG, THIS, THAT')
+        lines.append(f'    {TEMP_BASE:5}-{TEMP_BASE + TEMP_SIZE - 1:<5} '
+                     f'temp ({len(self.temps)} of {TEMP_SIZE} used)')
+        lines.append(f'    {TEMP_BASE + TEMP_SIZE:5}-{STATIC_BASE - 1:<5} '
+                     f'{", ".join(SCRATCH_REGISTERS)} (translator scratch)')
+        for file_name, file_statics in self.statics.items():
+            if file_statics:
+                addresses = file_statics.values()
+                lines.append(f'    {min(addresses):5}-{max(addresses):<5} '
+                             f'{file_name} statics ({len(file_statics)})')
+        if self.overflow():
+            lines.append(f'    {self.overflow()} statics overlap the stack!')
+        elif self.static_words < STATIC_AREA_SIZE:
+            lines.append(f'    {STATIC_BASE + self.static_words:5}-'
+                         f'{STACK_BASE - 1:<5} free')
+        return "\n".join(lines)